@@ -1,40 +1,65 @@
 import cv2
-import cvzone
 from cvzone.SelfiSegmentationModule import SelfiSegmentation
 from cvzone.FaceMeshModule import FaceMeshDetector
 import os
+import sys
+import threading
 import time
 import numpy as np
-import math
+from concurrent.futures import ThreadPoolExecutor
+
+# shared compositing code lives next to the web backend
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "WebPage", "backend"))
+from compositor import MaskBlender, compose
+from tracking import LandmarkTracker
+from segmentation import SegmentationStage
+from ar_engine import place_eyes, place_face, place_head, place_tears
+from assets import AssetCatalog
+from backgrounds import fast_blur
+from quality import QualityController, default_levels
 
 # ------------ Settings ------------
-BACKGROUND_FOLDER = "img"
-FILTER_FOLDER = "filters"
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKGROUND_FOLDER = os.path.join(APP_DIR, "img")
+FILTER_FOLDER = os.path.join(APP_DIR, "filters")
 EYES_FOLDER = os.path.join(FILTER_FOLDER, "eyes")
 FACE_FOLDER = os.path.join(FILTER_FOLDER, "face")
 HEAD_FOLDER = os.path.join(FILTER_FOLDER, "head")
 TEARS_FOLDER = os.path.join(FILTER_FOLDER, "tears")
 
 CAM_WIDTH, CAM_HEIGHT = 640, 480
-
-# ------------ Camera ------------
-cap = cv2.VideoCapture(0)
-cap.set(cv2.CAP_PROP_FRAME_WIDTH, CAM_WIDTH)
-cap.set(cv2.CAP_PROP_FRAME_HEIGHT, CAM_HEIGHT)
-cap.set(cv2.CAP_PROP_FPS, 60)
+MAX_FACES = 1       # faces that get accessories (e.g. 4 for group shots)
+MESH_INTERVAL = 4   # full face mesh every N frames, optical flow in between
+SEG_SCALE = 0.5     # person mask is inferred at this fraction of the frame size
+SEG_INTERVAL = 2    # ... every N frames
+FAST_BLUR = True    # blur a 1/4 size copy instead of the full frame
+MORPHOLOGY = True   # close/open the person mask (off: a bit faster, rougher edges)
+MORPH_KERNEL = np.ones((3, 3), np.uint8)
+ADAPTIVE = True     # lower mask scale / mesh cadence when frames take too long
+FRAME_BUDGET = 1 / 30
+PIPELINED = True    # capture / processing / display on separate threads
+PARALLEL_INFERENCE = True   # face mesh next to segmentation instead of after it
+SHOW_COMPARISON = True      # original camera view next to the output (key C)
 
 # ------------ CV Modules ------------
 segmentor = SelfiSegmentation()
-faceDetector = FaceMeshDetector(maxFaces=1)
-
-# ------------ Load backgrounds ------------
-imgList = []
-if os.path.exists(BACKGROUND_FOLDER):
-    for imgPath in os.listdir(BACKGROUND_FOLDER):
-        full_path = os.path.join(BACKGROUND_FOLDER, imgPath)
-        img = cv2.imread(full_path)
-        if img is not None:
-            imgList.append(cv2.resize(img, (CAM_WIDTH, CAM_HEIGHT)))
+faceDetector = FaceMeshDetector(maxFaces=MAX_FACES)
+faceTracker = LandmarkTracker(interval=MESH_INTERVAL)
+segStage = SegmentationStage(scale=SEG_SCALE, interval=SEG_INTERVAL)
+blender = MaskBlender()   # background blend buffers, only used by the processing thread
+# the preview window keeps its size, so only mask scale and mesh cadence adapt
+quality = QualityController(
+    [q._replace(output_scale=1.0) for q in default_levels(SEG_SCALE, MESH_INTERVAL)],
+    budget=FRAME_BUDGET, enabled=ADAPTIVE)
+
+# ------------ Load backgrounds and accessories ------------
+# memory-mapped from assets.atlas when it is up to date, decoded otherwise:
+# python ../WebPage/backend/atlas.py --filters filters --backgrounds img --out assets.atlas
+catalog = AssetCatalog(FILTER_FOLDER, BACKGROUND_FOLDER, atlas=os.path.join(APP_DIR, "assets.atlas"))
+
+# resized once per frame size that actually shows up
+bgStore = catalog.backgrounds
+imgList = bgStore.images
 
 # Solid colors
 colorList = [
@@ -44,377 +69,427 @@ colorList = [
     (255, 255, 255)
 ]
 
-# ------------ Load accessories ------------
-def load_png_folder(folder):
-    items = []
-    if os.path.exists(folder):
-        for f in os.listdir(folder):
-            if f.lower().endswith(".png"):
-                png = cv2.imread(os.path.join(folder, f), cv2.IMREAD_UNCHANGED)
-                if png is not None:
-                    items.append(png)
-    return items
-
-eyesAccessories = load_png_folder(EYES_FOLDER)
-faceAccessories = load_png_folder(FACE_FOLDER)
-headAccessories = load_png_folder(HEAD_FOLDER)
-tearAccessories = load_png_folder(TEARS_FOLDER)
-
-# ------------ State variables ------------
-indexImg = 0
-indexColor = 0
-
-mode = "image" if len(imgList) > 0 else "original"   # background mode
-
-# accessory on/off
-eyesOn = False
-faceOn = False
-headOn = False
-tearsOn = False
-
-# which item inside each group
-eyesIndex = 0
-faceIndex = 0
-headIndex = 0
-tearsIndex = 0
-
-# which group is currently selected for [ / ] switching
-currentCategory = None  # "eyes", "face", "head", "tears"
-
-pTime = 0
-prevMask = None
-tearOffset = 0
-
+eyesAccessories = catalog.sprites("eyes")
+faceAccessories = catalog.sprites("face")
+headAccessories = catalog.sprites("head")
+tearAccessories = catalog.sprites("tears")
 
 # ------------ Helpers ------------
 
-def dist(p1, p2):
-    return math.dist((p1[0], p1[1]), (p2[0], p2[1]))
+def detect_faces(img):
+    _, faces = faceDetector.findFaceMesh(img, draw=False)
+    return faces
 
 
-def overlay_soft_bg(img, bg, prev_mask=None, smooth=31, alpha_mask=0.7):
-    """Smooth, temporally-stable background replacement."""
-    imgNoBg = segmentor.removeBG(img, (0, 0, 0))
-    gray = cv2.cvtColor(imgNoBg, cv2.COLOR_BGR2GRAY)
-    _, mask = cv2.threshold(gray, 10, 255, cv2.THRESH_BINARY)
+def overlay_soft_bg(img, bg, stage, smooth=31, morph=MORPHOLOGY, out=None):
+    """Smooth, temporally-stable background replacement.
 
-    kernel = np.ones((5, 5), np.uint8)
-    mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel, iterations=2)
-    mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, kernel, iterations=1)
+    The mask is built and cleaned up at the stage's low resolution (the
+    stage also does the temporal blending); only the final soft mask is
+    upsampled and the composite runs at full resolution, as an 8-bit
+    blend into out (a new image if not given) with reused scratch buffers.
+    """
+    h, w = img.shape[:2]
+    small = stage.update(img, segmentor)
+    mask = cv2.compare(small, 0.1, cv2.CMP_GT)   # uint8 0 / 255
+
+    if morph:
+        mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, MORPH_KERNEL, iterations=2)
+        mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, MORPH_KERNEL, iterations=1)
 
+    smooth = max(3, int(smooth * stage.scale))
     if smooth % 2 == 0:
         smooth += 1
     mask = cv2.GaussianBlur(mask, (smooth, smooth), 0)
-    mask = mask.astype(np.float32) / 255.0
-
-    if prev_mask is not None and prev_mask.shape == mask.shape:
-        mask = alpha_mask * mask + (1 - alpha_mask) * prev_mask
-
-    mask3 = cv2.merge([mask, mask, mask])
-
-    fg = img.astype(np.float32) * mask3
-    bg = bg.astype(np.float32) * (1 - mask3)
 
-    out = cv2.add(fg, bg)
-    return out.astype(np.uint8), mask
+    return blender.blend(img, bg, blender.upsample(mask, w, h), out)
 
 
-def place_eyes_accessory(img, face, png):
-    """Place glasses/goggles etc. around eyes."""
-    if png is None:
-        return img
-    try:
-        left, right = face[33], face[263]
-        topL, topR = face[159], face[386]
-
-        eye_width = dist(left, right)
-        if eye_width <= 0:
-            return img
+# Accessory geometry is shared with the web backend: ar_engine.place_* size
+# and position a layer for all faces at once (faces = n x 468 x 2 array) and
+# return the (sprite, x, y) list to draw. The *_placement functions hold the
+# desktop app's own fit: the face mask spans forehead to chin (1.2x, at
+# least 1.9x ear to ear wide), glasses sit 5% of their height lower, and
+# even tiny faces get their accessories. The place_*_accessory wrappers
+# draw one face straight away.
 
-        target_w = int(eye_width * 1.9)
-        target_h = int(target_w * png.shape[0] / png.shape[1])
-        png_resized = cv2.resize(png, (target_w, target_h), interpolation=cv2.INTER_AREA)
+def eyes_placement(faces, png):
+    return place_eyes(faces, png, drop=0.05, min_w=0)
 
-        cx = int((left[0] + right[0]) / 2)
-        cy = int((topL[1] + topR[1]) / 2) + int(target_h * 0.05)
 
-        x = cx - target_w // 2
-        y = cy - target_h // 2
+def face_placement(faces, png):
+    return place_face(faces, png, width=1.9, height=1.2, min_w=0)
 
-        return cvzone.overlayPNG(img, png_resized, [x, y])
-    except:
-        return img
 
+def head_placement(faces, png):
+    return place_head(faces, png, min_w=0)
 
-def place_face_accessory(img, face, png):
-    """
-    Place a full-face mask (transparent eyes etc.) over the face.
-    Covers from forehead to chin and from left to right side of face.
-    """
-    if png is None:
-        return img
-    try:
-        forehead = face[10]
-        chin = face[152]
-        leftCheek = face[234]
-        rightCheek = face[454]
-
-        face_width = dist(leftCheek, rightCheek)
-        face_height = chin[1] - forehead[1]
-        if face_width <= 0 or face_height <= 0:
-            return img
 
-        aspect = png.shape[1] / png.shape[0]  # w/h
+def tears_placement(faces, png, offset):
+    return place_tears(faces, png, offset, min_w=0)
 
-        # Start from vertical requirement: a bit taller than forehead→chin
-        target_h = int(face_height * 1.2)
-        target_w = int(target_h * aspect)
 
-        # Ensure it is wide enough to cover from ear to ear
-        min_w = int(face_width * 1.9)
-        if target_w < min_w:
-            target_w = min_w
-            target_h = int(target_w / aspect)
+def as_faces(face):
+    return np.asarray(face, np.float32)[None]
 
-        png_resized = cv2.resize(png, (target_w, target_h), interpolation=cv2.INTER_AREA)
 
-        cx = int((leftCheek[0] + rightCheek[0]) / 2)
-        # slight upward bias so it covers a bit above forehead and below chin
-        top_y = int(forehead[1] - target_h * 0.25)
+def place_eyes_accessory(img, face, png):
+    return compose(img, eyes_placement(as_faces(face), png))
 
-        x = cx - target_w // 2
-        y = top_y
 
-        return cvzone.overlayPNG(img, png_resized, [x, y])
-    except:
-        return img
+def place_face_accessory(img, face, png):
+    return compose(img, face_placement(as_faces(face), png))
 
 
 def place_head_accessory(img, face, png):
-    """
-    Place a crown/hat above head.
-    Bottom edge sits right at hairline (forehead landmark).
-    Scaled with face width so it adjusts with distance.
-    """
-    if png is None:
-        return img                  
-    try:
-        forehead = face[10]
-        leftCheek = face[234]
-        rightCheek = face[454]
-
-        head_width = dist(leftCheek, rightCheek)
-        if head_width <= 0:
-            return img
-
-        # Bigger factor for more coverage across head
-        target_w = int(head_width * 2.3)
-        aspect = png.shape[1] / png.shape[0]  # w/h
-        target_h = int(target_w / aspect)
-
-        png_resized = cv2.resize(png, (target_w, target_h), interpolation=cv2.INTER_AREA)
-
-        cx = int((leftCheek[0] + rightCheek[0]) / 2)
-
-        # bottom edge at (approx) hairline = forehead[1]
-        bottom_y = int(forehead[1] + target_h * 0.30)  # tiny overlap
-        top_y = bottom_y - target_h
-
-        x = cx - target_w // 2
-        y = top_y
-
-        return cvzone.overlayPNG(img, png_resized, [x, y])
-    except:
-        return img
+    return compose(img, head_placement(as_faces(face), png))
 
 
 def place_tears_accessory(img, face, png, offset):
-    """Place animated tears under eyes."""
-    if png is None:
-        return img
-    try:
-        leftT = face[145]
-        rightT = face[374]
-
-        tear_width = dist(leftT, rightT) * 0.25
-        if tear_width <= 0:
-            return img
-
-        target_w = int(tear_width)
-        target_h = int(target_w * png.shape[0] / png.shape[1])
-        png_resized = cv2.resize(png, (target_w, target_h), interpolation=cv2.INTER_AREA)
-
-        for p in [leftT, rightT]:
-            x = int(p[0] - target_w / 2)
-            y = int(p[1] + offset)
-            img = cvzone.overlayPNG(img, png_resized, [x, y])
-
-        return img
-    except:
-        return img
-
-
-# ------------ Main loop ------------
-
-while True:
-    success, frame = cap.read()
-    if not success:
-        break
-
-    # base image (no accessories yet)
-    baseImg = cv2.flip(frame, 1)
+    return compose(img, tears_placement(as_faces(face), png, offset))
+
+
+# ------------ Pipeline ------------
+
+class FrameSlot:
+    """Single-slot handoff between threads: put() replaces, get() waits."""
+
+    def __init__(self):
+        self._item = None
+        self._cond = threading.Condition()
+
+    def put(self, item):
+        """Returns the item it replaced (dropped unread), or None."""
+        with self._cond:
+            dropped, self._item = self._item, item
+            self._cond.notify()
+            return dropped
+
+    def get(self, timeout=None):
+        with self._cond:
+            if self._item is None:
+                self._cond.wait(timeout)
+            item, self._item = self._item, None
+            return item
+
+
+# face mesh runs here while the main/processing thread does segmentation
+meshPool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="mesh")
+
+
+def new_state():
+    return {
+        "mode": "image" if len(imgList) > 0 else "original",   # background mode
+        "indexImg": 0,
+        "indexColor": 0,
+
+        # accessory on/off
+        "eyesOn": False,
+        "faceOn": False,
+        "headOn": False,
+        "tearsOn": False,
+
+        # which item inside each group
+        "eyesIndex": 0,
+        "faceIndex": 0,
+        "headIndex": 0,
+        "tearsIndex": 0,
+
+        # which group is currently selected for [ / ] switching
+        "currentCategory": None,  # "eyes", "face", "head", "tears"
+
+        "tearOffset": 0,
+        "compare": SHOW_COMPARISON,   # original next to the output
+    }
+
+
+# Output frames are written straight into reused canvases: [original |
+# output] side by side, or just the output. A canvas only goes back on the
+# free list once it has been shown (or dropped unshown by the slot), so the
+# one on screen is never drawn into; in practice that is three canvases,
+# one each for the display, the slot and the frame being rendered.
+freeCanvases = []
+canvasLock = threading.Lock()
+
+
+def next_canvas(h, w, compare):
+    shape = (h, w * 2 if compare else w, 3)
+    with canvasLock:
+        while freeCanvases:
+            canvas = freeCanvases.pop()
+            if canvas.shape == shape:
+                return canvas
+            # other sizes are left over from before a resolution / compare
+            # change: let them go
+    return np.empty(shape, np.uint8)
+
+
+def release_canvas(canvas):
+    with canvasLock:
+        freeCanvases.append(canvas)
+
+
+def render(frame, state):
+    """Camera frame -> original/output view (everything but FPS)."""
+    tStart = time.perf_counter()
+    st = dict(state)  # keys may change state while we work on this frame
+    mode = st["mode"]
+    compare = st["compare"]
+
+    h, w = frame.shape[:2]
+    canvas = next_canvas(h, w, compare)
+    visOrig = canvas[:, :w] if compare else None
+    visOut = canvas[:, w:] if compare else canvas
+
+    # base image (no accessories yet), mirrored straight into the canvas:
+    # the left view when comparing, else the output view if nothing else
+    # is drawn there (the face tracker is done with it before accessories)
+    if compare:
+        baseImg = cv2.flip(frame, 1, dst=visOrig)
+    elif mode == "original":
+        baseImg = cv2.flip(frame, 1, dst=visOut)
+    else:
+        baseImg = cv2.flip(frame, 1)
 
-    # Face landmarks on base image
-    _, faces = faceDetector.findFaceMesh(baseImg, draw=False)
+    # Face landmarks on base image (tracked between inferences); independent
+    # of the background, so it can run next to the segmentation below
+    if PARALLEL_INFERENCE:
+        facesJob = meshPool.submit(faceTracker.update, baseImg, detect_faces)
+    else:
+        faces = faceTracker.update(baseImg, detect_faces)
 
     # ---- Background composite (no accessories involved) ----
-    h, w, _ = baseImg.shape
     if mode == "image" and len(imgList) > 0:
-        bg = imgList[indexImg]
-        imgOut, prevMask = overlay_soft_bg(baseImg, bg, prevMask)
-        modeText = f"BG: Image {indexImg+1}/{len(imgList)}"
+        bg = bgStore.get(st["indexImg"], w, h)
+        overlay_soft_bg(baseImg, bg, segStage, out=visOut)
+        modeText = f"BG: Image {st['indexImg']+1}/{len(imgList)}"
     elif mode == "color":
-        bg = np.full((h, w, 3), colorList[indexColor], dtype=np.uint8)
-        imgOut, prevMask = overlay_soft_bg(baseImg, bg, prevMask)
-        modeText = f"BG: Color {indexColor+1}/{len(colorList)}"
+        bg = bgStore.solid(colorList[st["indexColor"]], w, h)
+        overlay_soft_bg(baseImg, bg, segStage, out=visOut)
+        modeText = f"BG: Color {st['indexColor']+1}/{len(colorList)}"
     elif mode == "blur":
-        blurBg = cv2.GaussianBlur(baseImg, (51, 51), 0)
-        imgOut, prevMask = overlay_soft_bg(baseImg, blurBg, prevMask)
+        if FAST_BLUR:
+            blurBg = fast_blur(baseImg, 51)
+        else:
+            blurBg = cv2.GaussianBlur(baseImg, (51, 51), 0)
+        overlay_soft_bg(baseImg, blurBg, segStage, out=visOut)
         modeText = "BG: Blur"
     else:
-        imgOut = baseImg.copy()
-        prevMask = None
+        if compare:
+            visOut[:] = baseImg
+        segStage.reset()
         modeText = "BG: Original"
 
-    # ---- Now overlay accessories AFTER background ----
-    visOrig = baseImg.copy()
-    visOut = imgOut.copy()
+    if PARALLEL_INFERENCE:
+        faces = facesJob.result()
 
-    if faces:
-        face = faces[0]
+    # ---- Now overlay accessories AFTER background ----
+    # every accessory is sized and placed once, then drawn into both views
+    placements = []
+    tearOffset = st["tearOffset"]
 
+    if faces is not None and len(faces) > 0:
         # Face mask first
-        if faceOn and len(faceAccessories) > 0:
-            visOrig = place_face_accessory(visOrig, face, faceAccessories[faceIndex])
-            visOut = place_face_accessory(visOut, face, faceAccessories[faceIndex])
+        if st["faceOn"] and len(faceAccessories) > 0:
+            placements += face_placement(faces, faceAccessories[st["faceIndex"]])
 
         # Eyes
-        if eyesOn and len(eyesAccessories) > 0:
-            visOrig = place_eyes_accessory(visOrig, face, eyesAccessories[eyesIndex])
-            visOut = place_eyes_accessory(visOut, face, eyesAccessories[eyesIndex])
+        if st["eyesOn"] and len(eyesAccessories) > 0:
+            placements += eyes_placement(faces, eyesAccessories[st["eyesIndex"]])
 
         # Tears (animated)
-        if tearsOn and len(tearAccessories) > 0:
-            visOrig = place_tears_accessory(visOrig, face, tearAccessories[tearsIndex], tearOffset)
-            visOut = place_tears_accessory(visOut, face, tearAccessories[tearsIndex], tearOffset)
+        if st["tearsOn"] and len(tearAccessories) > 0:
+            placements += tears_placement(faces, tearAccessories[st["tearsIndex"]], tearOffset)
 
         # Head hat/crown last so it appears on top
-        if headOn and len(headAccessories) > 0:
-            visOrig = place_head_accessory(visOrig, face, headAccessories[headIndex])
-            visOut = place_head_accessory(visOut, face, headAccessories[headIndex])
+        if st["headOn"] and len(headAccessories) > 0:
+            placements += head_placement(faces, headAccessories[st["headIndex"]])
+
+    compose(visOut, placements)
+    if compare:
+        compose(visOrig, placements)
 
     # Animate tears (only when on)
-    if tearsOn and len(tearAccessories) > 0:
-        tearOffset = (tearOffset + 2) % 25
+    if st["tearsOn"] and len(tearAccessories) > 0:
+        state["tearOffset"] = (tearOffset + 2) % 25
     else:
-        tearOffset = 0
+        state["tearOffset"] = 0
 
-    # Stack for display
-    imgStacked = cvzone.stackImages([visOrig, visOut], 2, 1)
-
-    # FPS
-    cTime = time.time()
-    fps = 1 / (cTime - pTime) if pTime != 0 else 0
-    pTime = cTime
-    cv2.putText(imgStacked, f"FPS: {int(fps)}", (10, 40),
-                cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 0, 255), 2)
+    imgStacked = canvas
 
     # Info text
     cv2.putText(imgStacked, modeText, (10, 80),
                 cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 255), 2)
 
-    accInfo = f"Eyes:{'ON' if eyesOn else 'OFF'}  Face:{'ON' if faceOn else 'OFF'}  Head:{'ON' if headOn else 'OFF'}  Tears:{'ON' if tearsOn else 'OFF'}"
+    accInfo = f"Eyes:{'ON' if st['eyesOn'] else 'OFF'}  Face:{'ON' if st['faceOn'] else 'OFF'}  Head:{'ON' if st['headOn'] else 'OFF'}  Tears:{'ON' if st['tearsOn'] else 'OFF'}"
     cv2.putText(imgStacked, accInfo, (10, 110),
                 cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 2)
 
-    helpText = "BG:1-Orig 2-Img(A/D) 3-Color(J/L) 4-Blur | Acc:0-Off E-eyes F-face H-head T-tears [ / ] switch  Q-Quit"
+    helpText = "BG:1-Orig 2-Img(A/D) 3-Color(J/L) 4-Blur | Acc:0-Off E-eyes F-face H-head T-tears [ / ] switch  C-Compare  Q-Quit"
     cv2.putText(imgStacked, helpText,
                 (10, imgStacked.shape[0] - 20),
                 cv2.FONT_HERSHEY_SIMPLEX, 0.45, (230, 230, 230), 2)
 
-    cv2.imshow("IntelliVision AR Studio", imgStacked)
+    if quality.update(time.perf_counter() - tStart):
+        quality.apply(segStage, faceTracker)
 
-    # ------------ Keys ------------
-    key = cv2.waitKey(1) & 0xFF
+    return imgStacked
+
+
+def handle_key(key, state):
+    """Apply one key press to state; returns False on quit."""
+    mode = state["mode"]
+    category = state["currentCategory"]
+    groups = {
+        "eyes": ("eyesOn", "eyesIndex", eyesAccessories),
+        "face": ("faceOn", "faceIndex", faceAccessories),
+        "head": ("headOn", "headIndex", headAccessories),
+        "tears": ("tearsOn", "tearsIndex", tearAccessories),
+    }
 
     # Background modes
     if key == ord('1'):
-        mode = "original"
+        state["mode"] = "original"
     elif key == ord('2'):
-        mode = "image"
+        state["mode"] = "image"
     elif key == ord('3'):
-        mode = "color"
+        state["mode"] = "color"
     elif key == ord('4'):
-        mode = "blur"
+        state["mode"] = "blur"
 
     # Background navigation
     elif key == ord('a') and mode == "image" and len(imgList) > 0:
-        indexImg = (indexImg - 1) % len(imgList)
+        state["indexImg"] = (state["indexImg"] - 1) % len(imgList)
     elif key == ord('d') and mode == "image" and len(imgList) > 0:
-        indexImg = (indexImg + 1) % len(imgList)
+        state["indexImg"] = (state["indexImg"] + 1) % len(imgList)
     elif key == ord('j') and mode == "color":
-        indexColor = (indexColor - 1) % len(colorList)
+        state["indexColor"] = (state["indexColor"] - 1) % len(colorList)
     elif key == ord('l') and mode == "color":
-        indexColor = (indexColor + 1) % len(colorList)
+        state["indexColor"] = (state["indexColor"] + 1) % len(colorList)
 
     # Accessories toggle
     elif key == ord('0'):
-        eyesOn = faceOn = headOn = tearsOn = False
-        currentCategory = None
+        state["eyesOn"] = state["faceOn"] = state["headOn"] = state["tearsOn"] = False
+        state["currentCategory"] = None
 
-    elif key == ord('e'):
-        eyesOn = not eyesOn
-        if len(eyesAccessories) > 0:
-            currentCategory = "eyes"
+    elif key in (ord('e'), ord('f'), ord('h'), ord('t')):
+        name = {ord('e'): "eyes", ord('f'): "face", ord('h'): "head", ord('t'): "tears"}[key]
+        onKey, _, items = groups[name]
+        state[onKey] = not state[onKey]
+        if len(items) > 0:
+            state["currentCategory"] = name
 
-    elif key == ord('f'):
-        faceOn = not faceOn
-        if len(faceAccessories) > 0:
-            currentCategory = "face"
+    # Switch accessory inside current category
+    elif key in (ord('['), ord(']')) and category is not None:
+        _, indexKey, items = groups[category]
+        if len(items) > 0:
+            step = -1 if key == ord('[') else 1
+            state[indexKey] = (state[indexKey] + step) % len(items)
 
-    elif key == ord('h'):
-        headOn = not headOn
-        if len(headAccessories) > 0:
-            currentCategory = "head"
+    elif key == ord('c'):
+        state["compare"] = not state["compare"]
 
-    elif key == ord('t'):
-        tearsOn = not tearsOn
-        if len(tearAccessories) > 0:
-            currentCategory = "tears"
+    elif key == ord('q'):
+        return False
 
-    # Switch accessory inside current category
-    elif key == ord('['):
-        if currentCategory == "eyes" and len(eyesAccessories) > 0:
-            eyesIndex = (eyesIndex - 1) % len(eyesAccessories)
-        elif currentCategory == "face" and len(faceAccessories) > 0:
-            faceIndex = (faceIndex - 1) % len(faceAccessories)
-        elif currentCategory == "head" and len(headAccessories) > 0:
-            headIndex = (headIndex - 1) % len(headAccessories)
-        elif currentCategory == "tears" and len(tearAccessories) > 0:
-            tearsIndex = (tearsIndex - 1) % len(tearAccessories)
-
-    elif key == ord(']'):
-        if currentCategory == "eyes" and len(eyesAccessories) > 0:
-            eyesIndex = (eyesIndex + 1) % len(eyesAccessories)
-        elif currentCategory == "face" and len(faceAccessories) > 0:
-            faceIndex = (faceIndex + 1) % len(faceAccessories)
-        elif currentCategory == "head" and len(headAccessories) > 0:
-            headIndex = (headIndex + 1) % len(headAccessories)
-        elif currentCategory == "tears" and len(tearAccessories) > 0:
-            tearsIndex = (tearsIndex + 1) % len(tearAccessories)
+    return True
+
+
+def show(imgStacked, fpsState):
+    # FPS of frames actually shown
+    cTime = time.time()
+    pTime = fpsState["pTime"]
+    fps = 1 / (cTime - pTime) if pTime != 0 else 0
+    fpsState["pTime"] = cTime
+    cv2.putText(imgStacked, f"FPS: {int(fps)}  Q{quality.level}", (10, 40),
+                cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 0, 255), 2)
+    cv2.imshow("IntelliVision AR Studio", imgStacked)
+
+
+# ------------ Main loop ------------
+
+def run_sequential(cap, state):
+    fpsState = {"pTime": 0}
+    while True:
+        success, frame = cap.read()
+        if not success:
+            break
+        imgStacked = render(frame, state)
+        show(imgStacked, fpsState)
+        release_canvas(imgStacked)
+
+        # ------------ Keys ------------
+        if not handle_key(cv2.waitKey(1) & 0xFF, state):
+            break
+
+
+def run_pipelined(cap, state):
+    """capture thread -> processing thread -> display (this thread).
+
+    Each hop is a FrameSlot that only keeps the newest frame, so a slow
+    stage drops frames instead of building up latency, and camera reads
+    overlap with processing.
+    """
+    stop = threading.Event()
+    captured = FrameSlot()
+    rendered = FrameSlot()
+
+    def capture():
+        while not stop.is_set():
+            success, frame = cap.read()
+            if not success:
+                stop.set()
+                break
+            captured.put(frame)
+
+    def process():
+        try:
+            while not stop.is_set():
+                frame = captured.get(timeout=0.1)
+                if frame is not None:
+                    dropped = rendered.put(render(frame, state))
+                    if dropped is not None:
+                        release_canvas(dropped)
+        finally:
+            stop.set()  # don't leave the window hanging if rendering fails
+
+    threads = [threading.Thread(target=capture, name="capture", daemon=True),
+               threading.Thread(target=process, name="process", daemon=True)]
+    for t in threads:
+        t.start()
+
+    # HighGUI wants imshow/waitKey on the main thread
+    fpsState = {"pTime": 0}
+    try:
+        while not stop.is_set():
+            imgStacked = rendered.get(timeout=0.1)
+            if imgStacked is not None:
+                show(imgStacked, fpsState)   # imshow copies the pixels
+                release_canvas(imgStacked)
+            if not handle_key(cv2.waitKey(1) & 0xFF, state):
+                break
+    finally:
+        stop.set()
+        for t in threads:
+            t.join(timeout=2)
+
+
+def main():
+    # ------------ Camera ------------
+    cap = cv2.VideoCapture(0)
+    cap.set(cv2.CAP_PROP_FRAME_WIDTH, CAM_WIDTH)
+    cap.set(cv2.CAP_PROP_FRAME_HEIGHT, CAM_HEIGHT)
+    cap.set(cv2.CAP_PROP_FPS, 60)
+
+    state = new_state()
+    if PIPELINED:
+        run_pipelined(cap, state)
+    else:
+        run_sequential(cap, state)
+
+    cap.release()
+    cv2.destroyAllWindows()
 
-    elif key == ord('q'):
-        break
 
-cap.release()
-cv2.destroyAllWindows()
+if __name__ == "__main__":
+    main()
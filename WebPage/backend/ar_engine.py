@@ -1,48 +1,102 @@
 import cv2
 import os
-import math
+import itertools
+import threading
 import numpy as np
-import cvzone
-from cvzone.SelfiSegmentationModule import SelfiSegmentation
-from cvzone.FaceMeshModule import FaceMeshDetector
+from assets import AssetCatalog
+from compositor import MaskBlender, compose
+from resize_cache import resize_cache
+from tracking import LandmarkTracker
+from segmentation import SegmentationStage, segment, to_alpha
+from backgrounds import fast_blur
+from metrics import StageTimes
+from quality import QualityController, default_levels
+from encoders import Encoder
+from inference import INFER_WORKERS, InferenceScheduler
 
 # ---------------- INIT ----------------
-segmentor = SelfiSegmentation()
-detector = FaceMeshDetector(maxFaces=1)
+# MediaPipe graphs are not safe to share between threads, so every worker
+# thread (or process) gets its own detector instances on first use. Being
+# thread-local, creating them needs no lock. cvzone/mediapipe themselves
+# are only imported then too (~1 s), so importing this module stays cheap.
+_models = threading.local()
+
+# In tracking mode a FaceMesh graph uses the previous call's landmarks to
+# find the face in the next one. A worker thread (or a shared model thread,
+# AR_INFER_WORKERS) sees frames from every session interleaved, so the
+# graphs run in static mode and detect on every call; LandmarkTracker
+# provides the frame-to-frame continuity per session.
+
+def get_segmentor():
+    if not hasattr(_models, "segmentor"):
+        from cvzone.SelfiSegmentationModule import SelfiSegmentation
+        _models.segmentor = SelfiSegmentation()
+    return _models.segmentor
+
+def get_detector(max_faces=1):
+    # one graph per face limit, sessions may ask for different ones
+    if not hasattr(_models, "detectors"):
+        _models.detectors = {}
+    if max_faces not in _models.detectors:
+        from cvzone.FaceMeshModule import FaceMeshDetector
+        _models.detectors[max_faces] = FaceMeshDetector(staticMode=True, maxFaces=max_faces)
+    return _models.detectors[max_faces]
+
+def get_roi_detector():
+    # MediaPipe tracks in normalised image coordinates, so crops get their
+    # own graph instead of confusing the full-frame one
+    if not hasattr(_models, "roi_detector"):
+        from cvzone.FaceMeshModule import FaceMeshDetector
+        _models.roi_detector = FaceMeshDetector(staticMode=True, maxFaces=1)
+    return _models.roi_detector
+
+# ---------------- SHARED INFERENCE ----------------
+# With AR_INFER_WORKERS set, model calls from all sessions go through one
+# scheduler per process and run on its pinned model threads (whose
+# thread-local models above are then the only ones ever built).
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+def get_scheduler():
+    global _scheduler
+    if INFER_WORKERS > 0 and _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                _scheduler = InferenceScheduler(INFER_WORKERS)
+    return _scheduler
+
+def infer(fn, *args):
+    scheduler = get_scheduler()
+    return fn(*args) if scheduler is None else scheduler.call(fn, *args)
+
+def run_segmentor(rgb):
+    return segment(get_segmentor(), rgb)
+
+# full-frame blend buffers, reused frame to frame by each worker thread
+_scratch = threading.local()
+
+def get_blender():
+    if not hasattr(_scratch, "blender"):
+        _scratch.blender = MaskBlender()
+    return _scratch.blender
 
 ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
 FILTER_DIR = os.path.join(ROOT, "filters")
 BG_DIR = os.path.join(ROOT, "backgrounds")
 
-# ---------------- LOAD ASSETS ----------------
-def load_pngs(folder):
-    arr = []
-    if os.path.exists(folder):
-        for f in os.listdir(folder):
-            if f.lower().endswith(".png"):
-                p = cv2.imread(os.path.join(folder, f), cv2.IMREAD_UNCHANGED)
-                if p is not None and p.shape[2] == 4:
-                    arr.append(p)
-    return arr
-
-def load_bgs(folder):
-    arr = []
-    if os.path.exists(folder):
-        for f in os.listdir(folder):
-            if f.lower().endswith((".jpg", ".png")):
-                img = cv2.imread(os.path.join(folder, f))
-                if img is not None:
-                    arr.append(img)
-    return arr
-
-eyes_pngs  = load_pngs(os.path.join(FILTER_DIR, "eyes"))
-face_pngs  = load_pngs(os.path.join(FILTER_DIR, "face"))
-head_pngs  = load_pngs(os.path.join(FILTER_DIR, "head"))
-tears_pngs = load_pngs(os.path.join(FILTER_DIR, "tears"))
-bg_imgs    = load_bgs(BG_DIR)
-
-# ---------------- STATE ----------------
-STATE = {
+# ---------------- ASSETS ----------------
+# loaded on first use (or by warm_up), see assets.py. `python atlas.py`
+# builds the atlas; without one (or with a stale one) files are decoded.
+# New / changed / removed files are picked up every AR_ASSET_WATCH seconds
+# (0 = off) without a restart.
+ATLAS = os.environ.get("AR_ASSET_ATLAS", os.path.join(ROOT, "assets.atlas"))
+ASSET_WATCH = float(os.environ.get("AR_ASSET_WATCH", "2"))
+catalog = AssetCatalog(FILTER_DIR, BG_DIR, atlas=ATLAS, watch=ASSET_WATCH)
+
+# ---------------- SESSION ----------------
+# Assets above are shared, read-only and process-wide. Everything that
+# changes per client lives on an ARSession, one per websocket connection.
+DEFAULT_STATE = {
     "camera_on": True,
     "bg_mode": "original",
     "bg_i": 0,
@@ -52,143 +106,259 @@ STATE = {
     "head": False,
     "tears": False,
 
-    "ei": 0, "fi": 0, "hi": 0, "ti": 0,
-    "tear_y": 0
+    "ei": 0, "fi": 0, "hi": 0, "ti": 0
 }
 
-# ---------------- FPS OPTIMIZATION STATE ----------------
-frame_count = 0
-cached_face = None
-png_cache = {}     # cache resized PNGs
+# full face mesh inference every N frames, optical flow in between
+MESH_INTERVAL = int(os.environ.get("AR_MESH_INTERVAL", "4"))
+
+# faces that get filters; AR_MAX_FACES=4 for group shots
+MAX_FACES = int(os.environ.get("AR_MAX_FACES", "1"))
+MAX_FACES_LIMIT = 8
+
+# run the mesh on a fixed-size crop around the last known face
+ROI_DETECT = os.environ.get("AR_ROI_DETECT", "1") == "1"
+ROI_SIZE = 256
+ROI_MARGIN = 0.4    # crop = landmark bbox grown by 40% on every side
+
+# person mask: inferred at SEG_SCALE of the frame every SEG_INTERVAL frames
+SEG_SCALE = float(os.environ.get("AR_SEG_SCALE", "0.5"))
+SEG_INTERVAL = int(os.environ.get("AR_SEG_INTERVAL", "2"))
+SEG_THRESHOLD = 0.85
+SEG_SOFTNESS = 0.1  # alpha ramps from 0 to 255 over threshold +- softness
+
+_session_ids = itertools.count(1)
+
+class ARSession:
+    # fields written by process_frame (copied back from process-pool workers)
+    TRACKING_FIELDS = ("frame_count", "tracker", "tear_y", "segmentation", "timings", "quality")
+
+    def __init__(self, **state):
+        self.id = next(_session_ids)
+        self.state = dict(DEFAULT_STATE, **state)
+
+        # ---------- FPS OPTIMIZATION STATE ----------
+        self.frame_count = 0
+        self.tracker = LandmarkTracker(interval=MESH_INTERVAL)   # landmark cache
+        self.roi_detect = ROI_DETECT
+        self.max_faces = MAX_FACES
+        self.tear_y = 0
+        self.segmentation = SegmentationStage(SEG_SCALE, SEG_INTERVAL)   # mask history
+        self.quality = QualityController(default_levels(SEG_SCALE, MESH_INTERVAL))
+
+        # ---------- STREAM STATS (owned by the websocket handler) ----------
+        self.frames_processed = 0
+        self.frames_dropped = 0
+        self.send_acks = False
+        self.encoder = Encoder()      # output codec settings, set by the client
+        self.timings = StageTimes()   # per-stage latency histograms
+
+    def handle_command(self, cmd):
+        state = self.state
+        if cmd["action"] == "toggle":
+            state[cmd["key"]] = not state[cmd["key"]]
+        elif cmd["action"] == "next":
+            state[cmd["key"]] += 1
+        elif cmd["action"] == "camera":
+            state["camera_on"] = cmd["value"]
+        elif cmd["action"] == "bg":
+            state["bg_mode"] = cmd["mode"]
+        elif cmd["action"] == "next_bg":
+            state["bg_i"] += 1
+
+    def set_max_faces(self, n):
+        self.max_faces = min(MAX_FACES_LIMIT, max(1, int(n)))
+
+    def sync_from(self, other):
+        if other is not self:
+            # /metrics/on|off or {"adaptive": ...} may have been hit while
+            # the frame was out
+            timing, adaptive = self.timings.enabled, self.quality.enabled
+            for k in self.TRACKING_FIELDS:
+                setattr(self, k, getattr(other, k))
+            self.timings.enabled = timing
+            self.quality.enabled = adaptive
 
 # ---------------- HELPERS ----------------
-def dist(a, b):
-    return math.dist((a[0], a[1]), (b[0], b[1]))
+def detect_faces(img, detector=None, max_faces=1):
+    try:
+        _, faces = (detector or get_detector(max_faces)).findFaceMesh(img, False)
+        return faces
+    except:
+        return []
+
+def detect_faces_roi(img, last_faces):
+    # Crop a square around the previous landmarks, run the mesh on it at
+    # ROI_SIZE x ROI_SIZE and map the result back to frame coordinates, so
+    # cost no longer depends on the input resolution. Falls back to the
+    # full frame when there is no previous face or the crop loses it.
+    if last_faces is None or len(last_faces) != 1:
+        return detect_faces(img)
 
-def safe_overlay(img, png, x, y):
     h, w = img.shape[:2]
-    ph, pw = png.shape[:2]
+    (x1, y1), (x2, y2) = last_faces[0].min(axis=0), last_faces[0].max(axis=0)
+    side = max(x2 - x1, y2 - y1) * (1 + 2 * ROI_MARGIN)
+    cx, cy = (x1 + x2) / 2, (y1 + y2) / 2
 
-    x1 = max(0, x)
-    y1 = max(0, y)
-    x2 = min(w, x + pw)
-    y2 = min(h, y + ph)
+    x1 = int(max(0, cx - side / 2))
+    y1 = int(max(0, cy - side / 2))
+    x2 = int(min(w, cx + side / 2))
+    y2 = int(min(h, cy + side / 2))
+    if x2 - x1 < 32 or y2 - y1 < 32:
+        return detect_faces(img)
 
-    if x1 >= x2 or y1 >= y2:
-        return img
+    # same scale on both axes so a crop clipped at the frame edge isn't squashed
+    scale = ROI_SIZE / side
+    crop = cv2.resize(img[y1:y2, x1:x2], (round((x2 - x1) * scale), round((y2 - y1) * scale)),
+                      interpolation=cv2.INTER_LINEAR)
+    faces = detect_faces(crop, get_roi_detector())
+    if not faces:
+        return detect_faces(img)
 
-    px1 = x1 - x
-    py1 = y1 - y
-    px2 = px1 + (x2 - x1)
-    py2 = py1 + (y2 - y1)
+    return [np.asarray(f, np.float32) / scale + (x1, y1) for f in faces]
 
-    return cvzone.overlayPNG(
-        img,
-        png[py1:py2, px1:px2],
-        [x1, y1]
-    )
+# ---------------- PLACEMENT ----------------
+# Geometry for every face comes out of one set of array ops on the
+# (faces, 468, 2) landmarks; only the sprite lookup is per face. Each
+# place_* returns (sprite, x, y) for compose(). The keyword arguments are
+# the fit; the defaults are the web app's, the desktop app passes its own.
+def span(faces, a, b):
+    d = faces[:, a] - faces[:, b]
+    return np.hypot(d[:, 0], d[:, 1])
 
-def get_cached_png(png, w, h):
-    key = (id(png), w, h)
-    if key not in png_cache:
-        png_cache[key] = cv2.resize(png, (w, h), interpolation=cv2.INTER_AREA)
-    return png_cache[key]
+def place_face(faces, sprite, width=1.8, height=0, min_w=10):
+    # width x ear-to-ear; with height, the mask is height x forehead-to-chin
+    # tall instead, and the width is only a floor
+    widths = (span(faces, 234, 454) * width).astype(int)
+    if height:
+        tall = ((faces[:, 152, 1] - faces[:, 10, 1]) * height).astype(int)
+        aspect = sprite.shape[1] / sprite.shape[0]
+        widths = np.where(tall > 0, np.maximum((tall * aspect).astype(int), widths), 0)
+    cx = ((faces[:, 234, 0] + faces[:, 454, 0]) / 2).astype(int)
+    top = faces[:, 10, 1]
+    out = []
+    for i in np.flatnonzero(widths > min_w):
+        # bucketed size: place it with the size we actually got
+        png = resize_cache.get(sprite, widths[i])
+        ph, pw = png.shape[:2]
+        out.append((png, cx[i] - pw // 2, int(top[i] - ph * 0.25)))
+    return out
+
+def place_eyes(faces, sprite, drop=0, min_w=10):
+    # drop: move down by that fraction of the sprite's height
+    widths = (span(faces, 33, 263) * 1.9).astype(int)
+    cx = ((faces[:, 33, 0] + faces[:, 263, 0]) / 2).astype(int)
+    cy = ((faces[:, 159, 1] + faces[:, 386, 1]) / 2).astype(int)
+    out = []
+    for i in np.flatnonzero(widths > min_w):
+        png = resize_cache.get(sprite, widths[i])
+        ph, pw = png.shape[:2]
+        out.append((png, cx[i] - pw // 2, cy[i] + int(ph * drop) - ph // 2))
+    return out
+
+def place_tears(faces, sprite, offset, min_w=5):
+    widths = (span(faces, 145, 374) * 0.25).astype(int)
+    out = []
+    for i in np.flatnonzero(widths > min_w):
+        png = resize_cache.get(sprite, widths[i])
+        pw = png.shape[1]
+        for pt in (faces[i, 145], faces[i, 374]):
+            out.append((png, int(pt[0] - pw // 2), int(pt[1] + offset)))
+    return out
+
+def place_head(faces, sprite, min_w=20):
+    widths = (span(faces, 234, 454) * 2.3).astype(int)
+    cx = ((faces[:, 234, 0] + faces[:, 454, 0]) / 2).astype(int)
+    top = faces[:, 10, 1]
+    out = []
+    for i in np.flatnonzero(widths > min_w):
+        png = resize_cache.get(sprite, widths[i])
+        ph, pw = png.shape[:2]
+        out.append((png, cx[i] - pw // 2, int(top[i] + ph * 0.30 - ph)))
+    return out
 
 # ---------------- MAIN PROCESS ----------------
-def process_frame(img):
-    global frame_count, cached_face
+def process_frame(img, session):
+    state = session.state
 
-    if not STATE["camera_on"] or img is None:
+    if not state["camera_on"] or img is None:
         return None
 
-    frame_count += 1
-    img = cv2.flip(img, 1)
+    session.frame_count += 1
+    tm = session.timings
+    t = tm.start()
+    img = cv2.flip(session.quality.scale(img), 1)
     h, w = img.shape[:2]
+    t = tm.lap("flip", t)
 
-    # ---------- BACKGROUND (DOWNSCALED) ----------
-    if STATE["bg_mode"] in ("blur", "image"):
-        small = cv2.resize(img, (w // 2, h // 2))
-        if STATE["bg_mode"] == "blur":
-            bg_small = cv2.GaussianBlur(small, (21, 21), 0)
-        else:
-            bg = bg_imgs[STATE["bg_i"] % len(bg_imgs)]
-            bg_small = cv2.resize(bg, (w // 2, h // 2))
+    # ---------- BACKGROUND (LOW-RES MASK, FULL-RES COMPOSITE) ----------
+    backgrounds = catalog.backgrounds
+    if state["bg_mode"] == "blur" or (state["bg_mode"] == "image" and backgrounds):
+        mask = session.segmentation.update(img, lambda rgb: infer(run_segmentor, rgb))
+        t = tm.lap("segmentation", t)
+        # 8-bit alpha at mask resolution; only it gets upsampled
+        alpha = to_alpha(mask, SEG_THRESHOLD, SEG_SOFTNESS)
 
-        fg_small = segmentor.removeBG(small, bg_small, threshold=0.85)
-        img = cv2.resize(fg_small, (w, h))
+        if state["bg_mode"] == "blur":
+            bg = fast_blur(img, 41)
+        else:
+            bg = backgrounds.get(state["bg_i"], w, h)
 
-    # ---------- FACE MESH (EVERY 2 FRAMES) ----------
-    if frame_count % 2 == 0 or cached_face is None:
-        try:
-            _, faces = detector.findFaceMesh(img, False)
-            cached_face = faces[0] if faces else None
-        except:
-            cached_face = None
+        # img is our own flipped copy: blend the background into it
+        blender = get_blender()
+        blender.blend(img, bg, blender.upsample(alpha, w, h), out=img)
+        t = tm.lap("background", t)
 
-    if cached_face is None:
+    # ---------- FACE MESH (EVERY N FRAMES, TRACKED IN BETWEEN) ----------
+    # the ROI crop only ever holds one face, so it is single-face mode only
+    if session.roi_detect and session.max_faces == 1:
+        faces = session.tracker.update(img, lambda im: infer(detect_faces_roi, im, session.tracker.faces))
+    else:
+        faces = session.tracker.update(img, lambda im: infer(detect_faces, im, None, session.max_faces))
+    t = tm.lap("face_mesh", t)
+    if faces is None:
         return img
 
-    f = cached_face
-
-    # ---------- FACE ----------
-    if STATE["face"] and face_pngs:
-        p = face_pngs[STATE["fi"] % len(face_pngs)]
-        fw = int(dist(f[234], f[454]) * 1.8)
-        if fw > 10:
-            fh = int(fw * p.shape[0] / p.shape[1])
-            png = get_cached_png(p, fw, fh)
-            cx = int((f[234][0] + f[454][0]) / 2)
-            cy = int(f[10][1] - fh * 0.25)
-            img = safe_overlay(img, png, cx - fw // 2, cy)
-
-    # ---------- EYES ----------
-    if STATE["eyes"] and eyes_pngs:
-        p = eyes_pngs[STATE["ei"] % len(eyes_pngs)]
-        ew = int(dist(f[33], f[263]) * 1.9)
-        if ew > 10:
-            eh = int(ew * p.shape[0] / p.shape[1])
-            png = get_cached_png(p, ew, eh)
-            cx = int((f[33][0] + f[263][0]) / 2)
-            cy = int((f[159][1] + f[386][1]) / 2)
-            img = safe_overlay(img, png, cx - ew // 2, cy - eh // 2)
-
-    # ---------- TEARS ----------
-    if STATE["tears"] and tears_pngs:
-        p = tears_pngs[STATE["ti"] % len(tears_pngs)]
-        tw = int(dist(f[145], f[374]) * 0.25)
-        if tw > 5:
-            th = int(tw * p.shape[0] / p.shape[1])
-            png = get_cached_png(p, tw, th)
-            for pt in [f[145], f[374]]:
-                img = safe_overlay(
-                    img, png,
-                    int(pt[0] - tw // 2),
-                    int(pt[1] + STATE["tear_y"])
-                )
-            STATE["tear_y"] = (STATE["tear_y"] + 2) % 25
-
-    # ---------- HEAD ----------
-    if STATE["head"] and head_pngs:
-        p = head_pngs[STATE["hi"] % len(head_pngs)]
-        hw = int(dist(f[234], f[454]) * 2.3)
-        if hw > 20:
-            hh = int(hw * p.shape[0] / p.shape[1])
-            png = get_cached_png(p, hw, hh)
-            cx = int((f[234][0] + f[454][0]) / 2)
-            cy = int(f[10][1] + hh * 0.30 - hh)
-            img = safe_overlay(img, png, cx - hw // 2, cy)
+    # ---------- OVERLAYS (ALL FACES OF A LAYER AT ONCE) ----------
+    # layer order: face, eyes, tears, head; each layer is placed for every
+    # face in one array pass, then blended, and timed on its own
+    face_pngs, eyes_pngs = catalog.sprites("face"), catalog.sprites("eyes")
+    tears_pngs, head_pngs = catalog.sprites("tears"), catalog.sprites("head")
+    if state["face"] and face_pngs:
+        compose(img, place_face(faces, face_pngs[state["fi"] % len(face_pngs)]))
+        t = tm.lap("overlay_face", t)
+    if state["eyes"] and eyes_pngs:
+        compose(img, place_eyes(faces, eyes_pngs[state["ei"] % len(eyes_pngs)]))
+        t = tm.lap("overlay_eyes", t)
+    if state["tears"] and tears_pngs:
+        tears = place_tears(faces, tears_pngs[state["ti"] % len(tears_pngs)], session.tear_y)
+        if tears:
+            compose(img, tears)
+            session.tear_y = (session.tear_y + 2) % 25
+        t = tm.lap("overlay_tears", t)
+    if state["head"] and head_pngs:
+        compose(img, place_head(faces, head_pngs[state["hi"] % len(head_pngs)]))
+        tm.lap("overlay_head", t)
 
     return img
 
-# ---------------- COMMAND HANDLER ----------------
-def handle_command(cmd):
-    if cmd["action"] == "toggle":
-        STATE[cmd["key"]] = not STATE[cmd["key"]]
-    elif cmd["action"] == "next":
-        STATE[cmd["key"]] += 1
-    elif cmd["action"] == "camera":
-        STATE["camera_on"] = cmd["value"]
-    elif cmd["action"] == "bg":
-        STATE["bg_mode"] = cmd["mode"]
-    elif cmd["action"] == "next_bg":
-        STATE["bg_i"] += 1
+# ---------------- WARM-UP ----------------
+def warm_models():
+    # the first inference of each graph is much slower than the rest
+    blank = np.zeros((ROI_SIZE, ROI_SIZE, 3), np.uint8)
+    run_segmentor(blank)
+    detect_faces(blank)
+    detect_faces(blank, get_roi_detector())
+
+def warm_up():
+    """Decode assets and build this thread's (or every model thread's) models.
+
+    Returns which process/thread was warmed.
+    """
+    catalog.load()
+    scheduler = get_scheduler()
+    if scheduler is None:
+        warm_models()
+    else:
+        scheduler.broadcast(warm_models)
+    return f"{os.getpid()}/{threading.current_thread().name}"
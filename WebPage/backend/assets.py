@@ -0,0 +1,205 @@
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+
+import atlas
+from backgrounds import BackgroundStore
+from compositor import Sprite
+from resize_cache import resize_cache
+
+CATEGORIES = ("eyes", "face", "head", "tears")
+BG_EXTS = (".jpg", ".jpeg", ".png")
+
+# ---------------- DECODING ----------------
+def load_sprite(path):
+    p = cv2.imread(path, cv2.IMREAD_UNCHANGED)
+    if p is None or p.ndim != 3 or p.shape[2] != 4:
+        return None
+    return Sprite.from_png(p)
+
+def load_background(path):
+    return cv2.imread(path)
+
+def list_files(folder, exts):
+    if not os.path.isdir(folder):
+        return []
+    return [os.path.join(folder, f) for f in sorted(os.listdir(folder)) if f.lower().endswith(exts)]
+
+def short_name(path):
+    # "eyes/glasses.png"
+    return os.path.join(os.path.basename(os.path.dirname(path)), os.path.basename(path))
+
+# ---------------- CATALOG ----------------
+# Filters and backgrounds are loaded on first use, not at import. If an
+# up-to-date atlas (see atlas.py) exists they are memory-mapped from it,
+# otherwise decoded in parallel (imread releases the GIL). Several threads
+# asking at once wait for the same single load.
+#
+# With watch=<seconds> a background thread polls the folders and reloads
+# only the files that were added, changed or removed. The new lists are
+# built next to the live ones and swapped in with one assignment, so
+# sessions keep rendering with the old set until the new one is ready.
+class AssetCatalog:
+    def __init__(self, filter_dir, bg_dir, threads=None, atlas=None, watch=0):
+        self.filter_dir = filter_dir
+        self.bg_dir = bg_dir
+        self.atlas = atlas
+        self.threads = threads or min(8, os.cpu_count() or 2)
+        self.watch = watch
+        self.source = None        # "atlas" or "decoded" once loaded
+        self.reloads = 0
+        self._sprites = None      # category -> [Sprite]
+        self._backgrounds = None  # BackgroundStore
+        self._assets = {}         # path -> Sprite / image (None: failed to decode)
+        self._stamps = {}         # path -> (size, mtime) it was loaded with
+        self._lock = threading.Lock()
+        self._watcher = None
+        self._stop = threading.Event()
+
+    @property
+    def loaded(self):
+        return self._sprites is not None
+
+    def load(self):
+        if self._sprites is not None:
+            return self
+        with self._lock:
+            if self._sprites is None:
+                self._load()
+        # started here rather than in __init__ so that every process-pool
+        # worker watches for its own copy of the catalog
+        if self.watch and self._watcher is None:
+            self.start_watching()
+        return self
+
+    def sources(self):
+        files = {c: list_files(os.path.join(self.filter_dir, c), (".png",)) for c in CATEGORIES}
+        files["backgrounds"] = list_files(self.bg_dir, BG_EXTS)
+        return files
+
+    def _decode(self, sources):
+        """{category: [paths]} -> {path: asset or None}, decoded in parallel."""
+        jobs = [(load_background if c == "backgrounds" else load_sprite, p)
+                for c, files in sources.items() for p in files]
+        with ThreadPoolExecutor(self.threads, thread_name_prefix="asset-load") as pool:
+            return dict(zip((p for _, p in jobs), pool.map(lambda job: job[0](job[1]), jobs)))
+
+    def _read_atlas(self):
+        sprites, bgs = atlas.read_atlas(self.atlas)
+        assets = {os.path.join(self.filter_dir, c, name): s for c, items in sprites.items() for name, s in items}
+        assets.update((os.path.join(self.bg_dir, name), b) for name, b in bgs)
+        return assets
+
+    def _stamp_all(self, sources):
+        stamps = {}
+        for files in sources.values():
+            for p in files:
+                try:
+                    stamps[p] = atlas.stamp(p)
+                except OSError:
+                    pass    # deleted since the listing; the next poll drops it
+        return stamps
+
+    def _load(self):
+        sources = self.sources()
+        if self.atlas and atlas.is_fresh(self.atlas, sources):
+            assets = self._read_atlas()
+            self.source = "atlas"
+        else:
+            assets = self._decode(sources)
+            self.source = "decoded"
+        self._stamps = self._stamp_all(sources)
+        self._swap(sources, assets)
+
+    def _swap(self, sources, assets):
+        self._assets = assets
+        sprites = {c: [assets[p] for p in sources[c] if assets.get(p) is not None] for c in CATEGORIES}
+        bgs = [assets[p] for p in sources["backgrounds"] if assets.get(p) is not None]
+
+        # resized backgrounds carry over for the images that didn't change
+        old = self._backgrounds
+        # backgrounds first: readers check _sprites to see if we're done
+        self._backgrounds = BackgroundStore(bgs) if old is None else old.updated(bgs)
+        self._sprites = sprites
+
+    # ---------- HOT RELOAD ----------
+    def reload(self):
+        """Pick up added / changed / removed files.
+
+        Returns {"added": [...], "changed": [...], "removed": [...]} file
+        names, or None if nothing changed (or nothing was loaded yet).
+        """
+        with self._lock:
+            if self._sprites is None:
+                return None
+            sources = self.sources()
+            stamps = self._stamp_all(sources)
+            added = [p for p in stamps if p not in self._stamps]
+            changed = [p for p in stamps if p in self._stamps and stamps[p] != self._stamps[p]]
+            removed = [p for p in self._stamps if p not in stamps]
+            if not (added or changed or removed):
+                return None
+
+            assets = dict(self._assets)
+            old = [assets.pop(p, None) for p in changed + removed]
+            todo = set(added + changed)
+            assets.update(self._decode({c: [p for p in files if p in todo] for c, files in sources.items()}))
+            self._stamps = stamps
+            self._swap(sources, assets)
+            self.reloads += 1
+
+        # resized copies of replaced sprites are never asked for again
+        for sprite in old:
+            if isinstance(sprite, Sprite):
+                resize_cache.invalidate(sprite)
+        return {"added": [short_name(p) for p in added], "changed": [short_name(p) for p in changed],
+                "removed": [short_name(p) for p in removed]}
+
+    def start_watching(self):
+        self._stop.clear()
+        self._watcher = threading.Thread(target=self._watch_loop, name="asset-watch", daemon=True)
+        self._watcher.start()
+
+    def stop_watching(self):
+        self._stop.set()
+
+    def _watch_loop(self):
+        while not self._stop.wait(self.watch):
+            try:
+                diff = self.reload()
+            except Exception as e:
+                # a half-written file or similar: try again on the next poll
+                print(f"asset reload failed: {e!r}", file=sys.stderr)
+                continue
+            if diff:
+                print(f"assets reloaded: {diff}", file=sys.stderr)
+
+    # ---------- ATLAS ----------
+    def compile(self, path):
+        """Decode the source folders and write them to an atlas at path."""
+        sources = self.sources()
+        assets = self._decode(sources)
+        sprites = {c: [(os.path.basename(p), assets[p]) for p in sources[c] if assets[p] is not None]
+                   for c in CATEGORIES}
+        bgs = [(os.path.basename(p), assets[p]) for p in sources["backgrounds"] if assets[p] is not None]
+        return atlas.write_atlas(path, sprites, bgs, sources)
+
+    # ---------- ACCESS ----------
+    def sprites(self, category):
+        return self.load()._sprites[category]
+
+    @property
+    def backgrounds(self):
+        return self.load()._backgrounds
+
+    def stats(self):
+        # doesn't trigger a load
+        sprites = self._sprites or {}
+        return {
+            **{c: len(v) for c, v in sprites.items()},
+            "backgrounds": len(self._backgrounds or ()),
+            "reloads": self.reloads,
+        }
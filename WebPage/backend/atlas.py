@@ -0,0 +1,146 @@
+"""Pre-decoded asset atlas: every filter sprite and background in one file.
+
+    python atlas.py                      # WebPage/filters + backgrounds
+    python atlas.py --filters ../../PythonGUI/filters --backgrounds ../../PythonGUI/img \\
+                    --out ../../PythonGUI/assets.atlas
+
+writes <out> (raw pixels) and <out>.json (index). Sprites are stored
+premultiplied BGRA with a chain of half-size mip levels, backgrounds as BGR.
+AssetCatalog memory-maps the file instead of decoding PNG/JPG, so startup
+costs no decoding, and every worker process reading the same atlas shares
+its pages through the OS page cache instead of holding its own copy.
+
+The index records size and mtime of every source file; when anything in the
+folders changes the atlas counts as stale and the catalog decodes the files
+again until the atlas is rebuilt.
+"""
+import argparse
+import json
+import os
+import sys
+
+import cv2
+import numpy as np
+
+from compositor import Sprite
+
+VERSION = 2
+ALIGN = 64       # every array starts on a cache line
+MIN_MIP = 16     # stop halving below this width / height
+
+# ---------------- SOURCES ----------------
+def stamp(path):
+    st = os.stat(path)
+    return st.st_size, st.st_mtime_ns
+
+def signature(files):
+    return [[os.path.basename(f), *stamp(f)] for f in files]
+
+def index_path(path):
+    return path + ".json"
+
+def is_fresh(path, sources):
+    """True if the atlas at path was built from exactly these files.
+
+    sources: {"eyes": [paths], ..., "backgrounds": [paths]}
+    """
+    try:
+        with open(index_path(path)) as f:
+            index = json.load(f)
+        recorded = index["sources"]
+        return index["version"] == VERSION and os.path.exists(path) and all(
+            recorded.get(k) == signature(files) for k, files in sources.items())
+    except (OSError, ValueError, KeyError):
+        return False
+
+# ---------------- WRITER ----------------
+def mip_chain(bgra):
+    levels = []
+    h, w = bgra.shape[:2]
+    while w // 2 >= MIN_MIP and h // 2 >= MIN_MIP:
+        w, h = w // 2, h // 2
+        levels.append(cv2.resize(levels[-1] if levels else bgra, (w, h), interpolation=cv2.INTER_AREA))
+    return levels
+
+def write_atlas(path, sprites, backgrounds, sources):
+    """sprites: {category: [(name, Sprite)]}, backgrounds: [(name, BGR image)]."""
+    entries = {"sprites": {}, "backgrounds": []}
+    offset = 0
+    blobs = []
+
+    def add(arr, name=None):
+        nonlocal offset
+        arr = np.ascontiguousarray(arr, dtype=np.uint8)
+        offset += -offset % ALIGN
+        entry = {"offset": offset, "shape": list(arr.shape)}
+        if name is not None:
+            entry["name"] = name
+        blobs.append((offset, arr))
+        offset += arr.nbytes
+        return entry
+
+    for category, items in sprites.items():
+        entries["sprites"][category] = [
+            [add(s.bgra, name)] + [add(m) for m in mip_chain(s.bgra)] for name, s in items]
+    entries["backgrounds"] = [add(b, name) for name, b in backgrounds]
+
+    # write under a temporary name, so a running server never maps a half
+    # written file
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        for start, arr in blobs:
+            f.seek(start)
+            f.write(arr.data)
+        f.truncate(offset)
+    index = {"version": VERSION, "size": offset,
+             "sources": {k: signature(files) for k, files in sources.items()}, **entries}
+    with open(index_path(path) + ".tmp", "w") as f:
+        json.dump(index, f)
+    os.replace(tmp, path)
+    os.replace(index_path(path) + ".tmp", index_path(path))
+    return index
+
+# ---------------- READER ----------------
+def read_atlas(path):
+    """Memory-map an atlas; returns the same (name, asset) lists write_atlas takes.
+
+    The arrays are read-only views into the mapping; pages are only read
+    from disk when a sprite or background is actually used.
+    """
+    with open(index_path(path)) as f:
+        index = json.load(f)
+    if index["size"] == 0:
+        return {c: [] for c in index["sprites"]}, []
+    data = np.memmap(path, dtype=np.uint8, mode="r", shape=(index["size"],))
+
+    def view(entry):
+        shape = tuple(entry["shape"])
+        start = entry["offset"]
+        return data[start:start + int(np.prod(shape))].reshape(shape)
+
+    sprites = {
+        category: [(levels[0]["name"], Sprite(view(levels[0]), tuple(view(m) for m in levels[1:])))
+                   for levels in items]
+        for category, items in index["sprites"].items()}
+    backgrounds = [(b["name"], view(b)) for b in index["backgrounds"]]
+    return sprites, backgrounds
+
+# ---------------- CLI ----------------
+def main(argv=None):
+    root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+    ap = argparse.ArgumentParser(description="Compile filters and backgrounds into an asset atlas.")
+    ap.add_argument("--filters", default=os.path.join(root, "filters"))
+    ap.add_argument("--backgrounds", default=os.path.join(root, "backgrounds"))
+    ap.add_argument("--out", default=os.path.join(root, "assets.atlas"))
+    args = ap.parse_args(argv)
+
+    from assets import AssetCatalog   # assets imports this module
+    catalog = AssetCatalog(args.filters, args.backgrounds, atlas=None)
+    index = catalog.compile(args.out)
+
+    counts = {c: len(v) for c, v in index["sprites"].items()}
+    print(f"{args.out}: {index['size'] / 1e6:.1f} MB, sprites {counts}, "
+          f"{len(index['backgrounds'])} backgrounds", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+import os
+import threading
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+# ---------------- BACKGROUND STORE ----------------
+# Backgrounds are resized once per resolution that is actually requested
+# and then reused every frame. Solid colours are allocated once per size.
+# Returned arrays are shared: callers must not draw into them.
+# Clients pick the resolution, so the copies are evicted least-recently-used
+# once they take more than AR_BG_CACHE_MB.
+MAX_BYTES = int(float(os.environ.get("AR_BG_CACHE_MB", "64")) * 1024 * 1024)
+
+class BackgroundStore:
+    def __init__(self, images=(), max_bytes=MAX_BYTES):
+        self.images = list(images)
+        self.max_bytes = max_bytes
+        # ("bg", index, w, h) -> resized image, ("solid", color, w, h) -> fill
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.images)
+
+    def get(self, i, w, h):
+        i %= len(self.images)
+        return self._cached(("bg", i, w, h),
+                            lambda: cv2.resize(self.images[i], (w, h), interpolation=cv2.INTER_AREA))
+
+    def solid(self, color, w, h):
+        return self._cached(("solid", tuple(color), w, h),
+                            lambda: np.full((h, w, 3), color, dtype=np.uint8))
+
+    def _cached(self, key, make):
+        with self._lock:
+            img = self._entries.get(key)
+            if img is not None:
+                self._entries.move_to_end(key)
+                return img
+        img = make()
+        with self._lock:
+            if key in self._entries:
+                return self._entries[key]
+            self._add(key, img)
+        return img
+
+    def _add(self, key, img):
+        self._entries[key] = img
+        self.bytes += img.nbytes
+        while self.bytes > self.max_bytes and len(self._entries) > 1:
+            _, old = self._entries.popitem(last=False)
+            self.bytes -= old.nbytes
+            self.evictions += 1
+
+    def updated(self, images):
+        """A new store for images that keeps the resized copies (and solid
+        fills) of every image it shares with this one."""
+        store = BackgroundStore(images, self.max_bytes)
+        index = {id(img): j for j, img in enumerate(store.images)}
+        with self._lock:
+            for key, img in self._entries.items():   # oldest first, as here
+                if key[0] == "bg":
+                    j = index.get(id(self.images[key[1]]))
+                    if j is None:
+                        continue
+                    key = ("bg", j) + key[2:]
+                store._add(key, img)
+        return store
+
+    def invalidate(self, i=None):
+        # drop the resized copies of one background (or all of them)
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == "bg" and (i is None or k[1] == i)]:
+                self.bytes -= self._entries.pop(key).nbytes
+
+# ---------------- CHEAP BLUR ----------------
+def fast_blur(img, ksize=51, factor=4):
+    """Approximate a ksize x ksize Gaussian blur for a background.
+
+    Blurs a 1/factor copy with a proportionally smaller kernel and scales it
+    back up; the upscale's interpolation hides the lost detail, which a
+    blurred background doesn't need anyway. ~factor^2 fewer pixels to blur.
+    """
+    h, w = img.shape[:2]
+    small = cv2.resize(img, (max(1, w // factor), max(1, h // factor)), interpolation=cv2.INTER_AREA)
+    k = max(3, ksize // factor) | 1
+    small = cv2.GaussianBlur(small, (k, k), 0)
+    return cv2.resize(small, (w, h), interpolation=cv2.INTER_LINEAR)
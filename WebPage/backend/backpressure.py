@@ -0,0 +1,31 @@
+import asyncio
+from collections import namedtuple
+
+# one frame waiting to be processed; legacy=True for base64 JSON frames,
+# received is the time.perf_counter() at which it came off the socket
+PendingFrame = namedtuple("PendingFrame", "seq codec payload legacy received")
+
+# ---------------- LATEST-FRAME-WINS SLOT ----------------
+# The receiver puts every incoming frame here and the processing task takes
+# them out. There is only room for one: a frame that is still waiting when
+# a newer one arrives is dropped, so latency can't pile up behind a slow
+# worker.
+class LatestFrameSlot:
+    def __init__(self):
+        self._frame = None
+        self._ready = asyncio.Event()
+
+    def put(self, frame):
+        # returns the stale frame that was replaced (dropped), if any
+        dropped, self._frame = self._frame, frame
+        self._ready.set()
+        return dropped
+
+    async def get(self):
+        await self._ready.wait()
+        self._ready.clear()
+        frame, self._frame = self._frame, None
+        return frame
+
+    def __len__(self):
+        return 0 if self._frame is None else 1
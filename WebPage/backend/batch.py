@@ -0,0 +1,229 @@
+import asyncio
+import functools
+import json
+import os
+import re
+import tempfile
+import uuid
+import zipfile
+from urllib.parse import quote
+
+import workers
+from encoders import Encoder
+from protocol import CODEC_JPEG, CODEC_WEBP
+
+# ---------------- CONFIG ----------------
+# AR_BATCH_MAX_IMAGES caps one request and AR_BATCH_MAX_IMAGE_MB one image
+# (uncompressed, for zip entries); AR_BATCH_INFLIGHT is how many of its
+# images may sit on the worker pool at once (default: half the workers), so
+# a big upload can't starve the live websocket sessions
+MAX_IMAGES = int(os.environ.get("AR_BATCH_MAX_IMAGES", "1000"))
+MAX_IMAGE_BYTES = int(float(os.environ.get("AR_BATCH_MAX_IMAGE_MB", "25")) * 1024 * 1024)
+INFLIGHT = int(os.environ.get("AR_BATCH_INFLIGHT", "0")) or max(1, workers.WORKERS // 2)
+SPOOL_BYTES = 32 * 1024 * 1024   # zip bodies above this go to a temp file
+
+IMAGE_EXTS = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+MIME = {CODEC_JPEG: "image/jpeg", CODEC_WEBP: "image/webp"}
+EXT = {CODEC_JPEG: ".jpg", CODEC_WEBP: ".webp"}
+BG_MODES = ("original", "blur", "image")
+FILTERS = (("eyes", "ei"), ("face", "fi"), ("head", "hi"), ("tears", "ti"))
+
+class BatchError(ValueError):
+    pass
+
+# ---------------- SPEC ----------------
+# {"bg": "blur", "bg_index": 2, "eyes": 0, "head": true, "max_faces": 4,
+#  "mirror": false, "codec": "webp", "quality": 90}
+# A filter is on when its key is given: true / an index picks that sprite,
+# false / null leaves it off.
+def parse_spec(text):
+    """Spec JSON -> (session state, render options); raises BatchError."""
+    try:
+        spec = json.loads(text) if text else {}
+    except ValueError as e:
+        raise BatchError(f"spec is not valid JSON: {e}")
+    if not isinstance(spec, dict):
+        raise BatchError("spec must be a JSON object")
+
+    bg = spec.get("bg", "original")
+    if bg not in BG_MODES:
+        raise BatchError(f"bg must be one of {', '.join(BG_MODES)}")
+    try:
+        state = {"bg_mode": bg, "bg_i": int(spec.get("bg_index", 0))}
+        for key, idx in FILTERS:
+            value = spec.get(key)
+            if value is None or value is False:
+                continue
+            state[key] = True
+            state[idx] = 0 if value is True else int(value)
+        options = {"mirror": bool(spec.get("mirror", False)),
+                   "max_faces": int(spec.get("max_faces", 1))}
+    except (TypeError, ValueError) as e:
+        raise BatchError(f"bad spec value: {e}")
+
+    for key in ("codec", "quality", "subsampling"):
+        if key in spec:
+            options[key] = spec[key]
+    try:
+        Encoder().configure(options)   # the workers apply the same keys
+    except (TypeError, ValueError) as e:
+        raise BatchError(str(e))
+    return state, options
+
+# ---------------- INPUT ----------------
+# Nothing is decompressed up front: read_upload only lists the images (a
+# zip's directory says how big every entry is) and each one is read when
+# render_stream hands it to the pool, so at most INFLIGHT images of a
+# request are in memory at once.
+class Upload:
+    """The images of one request as (name, size, read) items; read() -> bytes.
+
+    Holds the spooled body / form files the items read from, until close().
+    """
+    def __init__(self):
+        self.items = []
+        self._open = []
+
+    def __len__(self):
+        return len(self.items)
+
+    def add(self, name, size, read):
+        self.items.append((name, size, read))
+
+    def keep(self, f):
+        self._open.append(f)
+        return f
+
+    def close(self):
+        while self._open:
+            self._open.pop().close()
+
+def is_image(name):
+    return not os.path.basename(name).startswith(".") and name.lower().endswith(IMAGE_EXTS)
+
+def read_file(fileobj):
+    fileobj.seek(0)
+    return fileobj.read(MAX_IMAGE_BYTES + 1)
+
+def read_entry(archive, info):
+    # never trust the size in the directory: stop one byte past the limit
+    with archive.open(info) as f:
+        return f.read(MAX_IMAGE_BYTES + 1)
+
+def add_zip(upload, fileobj):
+    try:
+        archive = upload.keep(zipfile.ZipFile(fileobj))
+    except zipfile.BadZipFile:
+        raise BatchError("not a zip file")
+    for info in archive.infolist():
+        if not info.is_dir() and is_image(info.filename):
+            upload.add(info.filename, info.file_size, functools.partial(read_entry, archive, info))
+
+async def read_upload(request):
+    """Returns (spec text, Upload) from a multipart form or zip body.
+
+    Multipart: any number of file fields (zips are expanded) and an optional
+    "spec" field. Raw body (application/zip): spec comes from ?spec=...
+    The caller closes the Upload (render_stream does once it's done).
+    """
+    content_type = request.headers.get("content-type", "")
+    upload = Upload()
+    try:
+        if content_type.startswith("multipart/form-data"):
+            form = await request.form(max_files=MAX_IMAGES, max_fields=16)
+            spec = form.get("spec") or request.query_params.get("spec")
+            for _, value in form.multi_items():
+                if isinstance(value, str):
+                    continue
+                upload.keep(value.file)
+                name = value.filename or f"image{len(upload)}"
+                if name.lower().endswith(".zip"):
+                    add_zip(upload, value.file)
+                else:
+                    upload.add(name, value.size or 0, functools.partial(read_file, value.file))
+        else:
+            spec = request.query_params.get("spec")
+            body = upload.keep(tempfile.SpooledTemporaryFile(SPOOL_BYTES))
+            async for chunk in request.stream():
+                body.write(chunk)
+            body.seek(0)
+            add_zip(upload, body)
+
+        if not upload.items:
+            raise BatchError("no images in the request")
+        if len(upload) > MAX_IMAGES:
+            raise BatchError(f"at most {MAX_IMAGES} images per request")
+    except BaseException:
+        upload.close()
+        raise
+    return spec, upload
+
+# ---------------- OUTPUT ----------------
+# multipart/mixed: one part per image, in the order they finish. Each part
+# carries X-Index (position in the upload) and the original file name with
+# the output extension; images that can't be decoded get a JSON error part.
+def new_boundary():
+    return uuid.uuid4().hex
+
+def part(boundary, headers, body):
+    head = "".join(f"{k}: {v}\r\n" for k, v in headers.items())
+    return [f"--{boundary}\r\n{head}\r\n".encode(), body, b"\r\n"]
+
+def disposition(name):
+    # names come from the upload: control characters (CR / LF would start a
+    # new header) never get through; filename= is a plain ASCII fallback,
+    # filename* (RFC 5987) carries the real name
+    name = re.sub(r"[\x00-\x1f\x7f]", "", name)
+    fallback = re.sub(r'[^\x20-\x7e]|["\\]', "_", name)
+    return f"attachment; filename=\"{fallback}\"; filename*=UTF-8''{quote(name)}"
+
+def result_part(boundary, index, name, buf, codec, error=None):
+    if buf is None:
+        body = json.dumps({"index": index, "name": name, "error": error or "could not decode image"}).encode()
+        return part(boundary, {"Content-Type": "application/json", "X-Index": index}, body)
+    out_name = os.path.splitext(os.path.basename(name))[0] + EXT[codec]
+    return part(boundary, {
+        "Content-Type": MIME[codec],
+        "Content-Disposition": disposition(out_name),
+        "X-Index": index,
+    }, memoryview(buf))
+
+async def render_stream(boundary, upload, state, options):
+    """Process the upload on the worker pool, yield each result part as it's
+    done; closes the upload at the end."""
+    too_big = f"larger than {MAX_IMAGE_BYTES / 1024 / 1024:.3g} MB (AR_BATCH_MAX_IMAGE_MB)"
+
+    async def job(index, name, size, read):
+        if size > MAX_IMAGE_BYTES:
+            return index, name, None, None, too_big
+        try:
+            # decompress / read off the event loop, one image per job
+            payload = await asyncio.to_thread(read)
+            if len(payload) > MAX_IMAGE_BYTES:
+                return index, name, None, None, too_big
+            buf, codec = await workers.run_image(state, options, payload)
+            return index, name, buf, codec
+        except Exception as e:
+            # one broken image shouldn't end the whole response
+            return index, name, None, None, f"processing failed: {e!r}"
+
+    queue = iter(enumerate(upload.items))
+    running = set()
+    try:
+        while True:
+            for index, (name, size, read) in queue:
+                running.add(asyncio.ensure_future(job(index, name, size, read)))
+                if len(running) >= INFLIGHT:
+                    break
+            if not running:
+                break
+            done, running = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                for chunk in result_part(boundary, *task.result()):
+                    yield chunk
+        yield f"--{boundary}--\r\n".encode()
+    finally:
+        # client went away: don't leave its images queued on the pool
+        for task in running:
+            task.cancel()
+        upload.close()
@@ -0,0 +1,140 @@
+import cv2
+import numpy as np
+
+# ---------------- SPRITES ----------------
+# Accessories are stored once as premultiplied BGR + 8-bit alpha (one BGRA
+# array). Premultiplied pixels can be resized directly without dark fringes
+# and blend with a single multiply-add per channel.
+class Sprite:
+    __slots__ = ("bgra", "mips", "_bgr", "_inv_alpha")
+
+    def __init__(self, bgra, mips=()):
+        self.bgra = bgra
+        self.mips = mips    # optional half, quarter, ... size copies (see atlas.py)
+        self._bgr = None
+        self._inv_alpha = None
+
+    @classmethod
+    def from_png(cls, png):
+        if png.ndim == 2:
+            png = cv2.cvtColor(png, cv2.COLOR_GRAY2BGRA)
+        elif png.shape[2] == 3:
+            # no alpha channel -> fully opaque
+            png = cv2.cvtColor(png, cv2.COLOR_BGR2BGRA)
+
+        bgra = png.copy()
+        a = png[..., 3:4].astype(np.uint16)
+        bgra[..., :3] = png[..., :3] * a // 255
+        return cls(bgra)
+
+    @property
+    def shape(self):
+        return self.bgra.shape
+
+    @property
+    def nbytes(self):
+        # BGRA + the premultiplied BGR and inverse alpha built for blending
+        h, w = self.bgra.shape[:2]
+        return h * w * 10
+
+    # blend inputs are built on first use, so full-size source sprites that
+    # only ever get resized never pay for them
+    @property
+    def bgr(self):
+        if self._bgr is None:
+            self._bgr = np.ascontiguousarray(self.bgra[..., :3])
+        return self._bgr
+
+    @property
+    def inv_alpha(self):
+        if self._inv_alpha is None:
+            self._inv_alpha = cv2.cvtColor(255 - self.bgra[..., 3], cv2.COLOR_GRAY2BGR)
+        return self._inv_alpha
+
+    def resized(self, w, h):
+        # start from the smallest mip level that is still at least w x h:
+        # INTER_AREA cost scales with the source size
+        src = self.bgra
+        for level in self.mips:
+            if level.shape[1] < w or level.shape[0] < h:
+                break
+            src = level
+        return Sprite(cv2.resize(src, (w, h), interpolation=cv2.INTER_AREA))
+
+# ---------------- BLENDING ----------------
+def overlay(img, sprite, x, y):
+    """Blend sprite onto img in place with its top-left corner at (x, y).
+
+    Only the part that lands inside img is touched: one ROI-sized
+    temporary, no float conversion and no full-frame copies.
+    """
+    h, w = img.shape[:2]
+    ph, pw = sprite.bgra.shape[:2]
+
+    x1 = max(0, x)
+    y1 = max(0, y)
+    x2 = min(w, x + pw)
+    y2 = min(h, y + ph)
+
+    if x1 >= x2 or y1 >= y2:
+        return img
+
+    px1 = x1 - x
+    py1 = y1 - y
+    px2 = px1 + (x2 - x1)
+    py2 = py1 + (y2 - y1)
+
+    roi = img[y1:y2, x1:x2]
+
+    # out = src + dst * (255 - a) / 255. OpenCV's saturating uint8 ops do
+    # the rounding and clamp the +1 overshoot of resampled premultiplied
+    # pixels, and run ~10x faster than the same math in uint16 numpy.
+    t = cv2.multiply(roi, sprite.inv_alpha[py1:py2, px1:px2], scale=1 / 255)
+    cv2.add(t, sprite.bgr[py1:py2, px1:px2], dst=roi)
+    return img
+
+def compose(img, placements):
+    """Blend a list of (sprite, x, y) onto img in order, in place."""
+    for sprite, x, y in placements:
+        overlay(img, sprite, int(x), int(y))
+    return img
+
+# ---------------- MASKED BLEND ----------------
+# Full-frame foreground/background mix with an 8-bit alpha mask:
+#     out = fg * a / 255 + bg * (255 - a) / 255
+# in saturating uint8 (off by at most 1 from the float result). All
+# full-frame temporaries are kept between calls, so a steady stream of
+# same-sized frames allocates nothing. One blender per thread.
+class MaskBlender:
+    def __init__(self):
+        self._shape = None
+        self._mask = self._alpha = self._inv_alpha = self._tmp = None
+
+    def _scratch(self, h, w):
+        if self._shape != (h, w):
+            self._shape = (h, w)
+            self._mask = np.empty((h, w), np.uint8)
+            self._alpha = np.empty((h, w, 3), np.uint8)
+            self._inv_alpha = np.empty((h, w, 3), np.uint8)
+            self._tmp = np.empty((h, w, 3), np.uint8)
+
+    def upsample(self, mask, w, h):
+        """Resize a low-res uint8 mask to w x h into the reused mask buffer."""
+        self._scratch(h, w)
+        return cv2.resize(mask, (w, h), dst=self._mask, interpolation=cv2.INTER_LINEAR)
+
+    def blend(self, fg, bg, mask, out=None):
+        """Mix fg (where mask is 255) over bg into out (default: new array).
+
+        out may be fg itself or a view into a bigger image, but not bg.
+        """
+        h, w = fg.shape[:2]
+        self._scratch(h, w)
+        if out is None:
+            out = np.empty_like(fg)
+        cv2.cvtColor(mask, cv2.COLOR_GRAY2BGR, dst=self._alpha)
+        cv2.bitwise_not(self._alpha, dst=self._inv_alpha)
+        cv2.multiply(fg, self._alpha, dst=self._tmp, scale=1 / 255)
+        cv2.multiply(bg, self._inv_alpha, dst=out, scale=1 / 255)
+        cv2.add(self._tmp, out, dst=out)
+        return out
@@ -0,0 +1,119 @@
+import os
+
+import cv2
+import numpy as np
+
+from protocol import CODEC_EXT, CODEC_JPEG, CODEC_WEBP
+
+# libjpeg-turbo bindings are optional (pip install PyTurboJPEG); without
+# them everything goes through OpenCV
+try:
+    from turbojpeg import TJSAMP_420, TJSAMP_422, TJSAMP_444, TurboJPEG
+except ImportError:
+    TurboJPEG = None
+
+# ---------------- CONFIG ----------------
+# AR_JPEG_QUALITY / AR_JPEG_SUBSAMPLING are the defaults a client can
+# override with {"type": "config", ...}; AR_TURBOJPEG=0 ignores turbojpeg
+DEFAULT_QUALITY = int(os.environ.get("AR_JPEG_QUALITY", "80"))
+DEFAULT_SUBSAMPLING = os.environ.get("AR_JPEG_SUBSAMPLING", "420")
+USE_TURBOJPEG = os.environ.get("AR_TURBOJPEG", "1") == "1"
+
+CODEC_NAMES = {"jpeg": CODEC_JPEG, "webp": CODEC_WEBP}
+
+CV_SUBSAMPLING = {
+    "444": cv2.IMWRITE_JPEG_SAMPLING_FACTOR_444,
+    "422": cv2.IMWRITE_JPEG_SAMPLING_FACTOR_422,
+    "420": cv2.IMWRITE_JPEG_SAMPLING_FACTOR_420,
+}
+TJ_SUBSAMPLING = {"444": TJSAMP_444, "422": TJSAMP_422, "420": TJSAMP_420} if TurboJPEG else {}
+
+# one TurboJPEG handle per process, created on first use (also in
+# process-pool workers, where it can't be pickled over)
+_turbo = None
+
+def get_turbo():
+    global _turbo
+    if _turbo is None and TurboJPEG is not None and USE_TURBOJPEG:
+        try:
+            _turbo = TurboJPEG()
+        except (OSError, RuntimeError):
+            # python package installed but the shared library is missing
+            _turbo = False
+    return _turbo or None
+
+# ---------------- ENCODER ----------------
+# Per-session codec settings. Holds only plain values so it can travel
+# with the ARSession to process-pool workers.
+class Encoder:
+    def __init__(self, codec=None, quality=DEFAULT_QUALITY, subsampling=DEFAULT_SUBSAMPLING):
+        self.codec = codec              # None: answer in the codec the client sent
+        self.quality = quality
+        self.subsampling = subsampling
+        self._params = {}               # (codec, quality) -> imencode params
+
+    def configure(self, data):
+        """Apply the encoder keys of a config message; raises ValueError."""
+        if "codec" in data:
+            if data["codec"] not in CODEC_NAMES:
+                raise ValueError(f"unknown codec {data['codec']!r}")
+            self.codec = CODEC_NAMES[data["codec"]]
+        if "quality" in data:
+            self.quality = min(100, max(1, int(data["quality"])))
+        if "subsampling" in data:
+            if data["subsampling"] not in CV_SUBSAMPLING:
+                raise ValueError(f"unknown subsampling {data['subsampling']!r}")
+            self.subsampling = data["subsampling"]
+        self._params.clear()
+
+    def describe(self):
+        return {
+            "codec": None if self.codec is None else {v: k for k, v in CODEC_NAMES.items()}[self.codec],
+            "quality": self.quality,
+            "subsampling": self.subsampling,
+            "turbojpeg": get_turbo() is not None,
+        }
+
+    def output_codec(self, input_codec):
+        return input_codec if self.codec is None else self.codec
+
+    def _cv_params(self, codec, quality):
+        params = self._params.get((codec, quality))
+        if params is None:
+            if codec == CODEC_WEBP:
+                params = [cv2.IMWRITE_WEBP_QUALITY, quality]
+            else:
+                params = [cv2.IMWRITE_JPEG_QUALITY, quality,
+                          cv2.IMWRITE_JPEG_SAMPLING_FACTOR, CV_SUBSAMPLING[self.subsampling]]
+            self._params[(codec, quality)] = params
+        return params
+
+    def encode(self, img, codec=CODEC_JPEG, quality_scale=1.0):
+        # returns any buffer (ndarray or bytes); pack_result copies it once.
+        # quality_scale < 1 is the adaptive quality controller stepping down
+        quality = max(1, round(self.quality * quality_scale))
+        if codec == CODEC_JPEG:
+            turbo = get_turbo()
+            if turbo is not None:
+                return turbo.encode(img, quality=quality, jpeg_subsample=TJ_SUBSAMPLING[self.subsampling])
+        ok, buf = cv2.imencode(CODEC_EXT.get(codec, ".jpg"), img, self._cv_params(codec, quality))
+        return buf if ok else None
+
+# ---------------- DECODER ----------------
+def decode(payload, codec=CODEC_JPEG):
+    # frombuffer wraps the received bytes/memoryview without copying
+    if codec == CODEC_JPEG:
+        turbo = get_turbo()
+        if turbo is not None:
+            try:
+                return turbo.decode(payload)
+            except (OSError, RuntimeError):
+                return None
+    return cv2.imdecode(np.frombuffer(payload, np.uint8), cv2.IMREAD_COLOR)
+
+def decode_image(payload):
+    # uploaded files: JPEG through decode(), anything else OpenCV reads
+    # (PNG, WebP, BMP, ...)
+    if bytes(payload[:2]) == b"\xff\xd8":
+        return decode(payload, CODEC_JPEG)
+    return cv2.imdecode(np.frombuffer(payload, np.uint8), cv2.IMREAD_COLOR)
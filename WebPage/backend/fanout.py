@@ -0,0 +1,195 @@
+import os
+import queue
+import secrets
+import threading
+import time
+
+import encoders
+from backpressure import LatestFrameSlot
+from protocol import CODEC_JPEG, HEADER, HEADER_SIZE
+
+# ---------------- CONFIG ----------------
+# Recording writes to the server's disk, so clients can only ask for it when
+# the server allows it: AR_RECORD=1 records every session, AR_RECORD_ALLOW=1
+# lets a client turn it on with {"type": "config", "record": true}. Either
+# way one recording stops at AR_RECORD_MAX_MB / AR_RECORD_MAX_SECONDS.
+RECORD_ALL = os.environ.get("AR_RECORD", "0") == "1"
+RECORD_ALLOW = RECORD_ALL or os.environ.get("AR_RECORD_ALLOW", "0") == "1"
+RECORD_DIR = os.environ.get("AR_RECORD_DIR", os.path.join(os.path.dirname(__file__), "..", "recordings"))
+RECORD_MAX_BYTES = int(float(os.environ.get("AR_RECORD_MAX_MB", "500")) * 1024 * 1024)
+RECORD_MAX_SECONDS = float(os.environ.get("AR_RECORD_MAX_SECONDS", "1800"))
+RECORD_QUEUE = 256   # frames waiting for the disk before the recorder drops
+
+# ---------------- RECORDER ----------------
+# Writes the result frames to an MJPEG stream that VLC / ffmpeg play
+# directly (ffmpeg -i x.mjpeg -c copy x.avi puts it in a container without
+# re-encoding). JPEG frames are written as they were sent; WebP sessions
+# cost one decode + JPEG encode per frame, on the recorder's thread.
+# x.idx has one "t seq offset size" line per frame, t in seconds since the
+# start, for the exact timing. All disk work happens on the recorder's own
+# thread; it stops by itself at the size / duration limit.
+class Recorder:
+    def __init__(self, path, max_bytes=RECORD_MAX_BYTES, max_seconds=RECORD_MAX_SECONDS):
+        self.path = path
+        self.name = os.path.basename(path)
+        self.max_bytes = max_bytes
+        self.max_seconds = max_seconds
+        self.frames = 0
+        self.dropped = 0
+        self.bytes = 0
+        self.full = False       # hit a limit, later frames are ignored
+        self._closing = False
+        self._queue = queue.Queue(RECORD_QUEUE)
+        self._start = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name="recorder", daemon=True)
+        self._thread.start()
+
+    def write(self, packed):
+        # packed = protocol header + payload, shared with the sockets
+        if self.full or self._closing:
+            return
+        try:
+            self._queue.put_nowait((time.perf_counter() - self._start, packed))
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self):
+        # called on the event loop: never wait for the disk
+        self._closing = True
+        try:
+            self._queue.put_nowait(None)
+        except queue.Full:
+            pass    # _run notices _closing once it has drained the queue
+
+    def _run(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        base = os.path.splitext(self.path)[0]
+        with open(self.path, "wb") as data, open(base + ".idx", "w") as index:
+            while True:
+                try:
+                    item = self._queue.get(timeout=0.5)
+                except queue.Empty:
+                    if self._closing:
+                        return
+                    continue
+                if item is None:
+                    return
+                t, packed = item
+                if self.full:
+                    continue
+                _, _, codec, seq = HEADER.unpack_from(packed)
+                payload = memoryview(packed)[HEADER_SIZE:]
+                if codec != CODEC_JPEG:
+                    payload = to_jpeg(payload, codec)
+                    if payload is None:
+                        continue
+                if self.bytes + len(payload) > self.max_bytes or t > self.max_seconds:
+                    self.full = True
+                    continue
+                data.write(payload)
+                index.write(f"{t:.4f} {seq} {self.bytes} {len(payload)}\n")
+                self.bytes += len(payload)
+                self.frames += 1
+
+def to_jpeg(payload, codec):
+    img = encoders.decode(payload, codec)
+    if img is None:
+        return None
+    return memoryview(encoders.Encoder().encode(img, CODEC_JPEG))
+
+# ---------------- CHANNEL ----------------
+# Everything one session's output goes to besides its own socket. The
+# frame is packed (header + encoded image) once, and that same bytes object
+# is handed to every viewer and the recorder. Each viewer has a
+# latest-frame slot, so a slow screen drops frames instead of holding up
+# the session or the other viewers.
+#
+# Viewers need the channel's random token, which only the session's own
+# client is told; the session id alone is guessable.
+class Channel:
+    def __init__(self, session_id):
+        self.session_id = session_id
+        self.token = secrets.token_urlsafe(16)
+        self.viewers = set()
+        self.recorder = None
+
+    @property
+    def active(self):
+        return bool(self.viewers) or self.recorder is not None
+
+    def add_viewer(self):
+        slot = LatestFrameSlot()
+        self.viewers.add(slot)
+        return slot
+
+    def remove_viewer(self, slot):
+        self.viewers.discard(slot)
+
+    def publish(self, packed):
+        for slot in self.viewers:
+            slot.put(packed)
+        if self.recorder is not None:
+            self.recorder.write(packed)
+
+    def check_token(self, token):
+        return secrets.compare_digest(self.token, token or "")
+
+    def start_recording(self, folder=RECORD_DIR):
+        """Start (or keep) recording; raises PermissionError if not allowed."""
+        if not RECORD_ALLOW:
+            raise PermissionError("recording is disabled on this server (AR_RECORD_ALLOW=1)")
+        if self.recorder is None:
+            name = f"session-{self.session_id}-{time.strftime('%Y%m%d-%H%M%S')}.mjpeg"
+            self.recorder = Recorder(os.path.join(folder, name))
+        return self.recorder
+
+    def stop_recording(self):
+        recorder, self.recorder = self.recorder, None
+        if recorder is not None:
+            recorder.close()
+        return recorder
+
+    def describe(self):
+        # for the session's own client only: includes the viewer token
+        rec = self.recorder
+        return {
+            "session": self.session_id,
+            "viewers": len(self.viewers),
+            "recording": None if rec is None else rec.name,
+            "recorded_frames": 0 if rec is None else rec.frames,
+            "recording_full": rec is not None and rec.full,
+            "view_token": self.token,
+        }
+
+    def close(self):
+        self.stop_recording()
+        for slot in self.viewers:
+            slot.put(None)      # tells the viewer's socket to close
+        self.viewers.clear()
+
+# ---------------- HUB ----------------
+# session id -> Channel for every live websocket session (event loop only,
+# so no locking)
+class Hub:
+    def __init__(self):
+        self.channels = {}
+
+    def open(self, session_id):
+        channel = self.channels[session_id] = Channel(session_id)
+        if RECORD_ALL:
+            channel.start_recording()
+        return channel
+
+    def close(self, session_id):
+        channel = self.channels.pop(session_id, None)
+        if channel is not None:
+            channel.close()
+
+    def get(self, session_id, token):
+        # unknown session and wrong token look the same to the caller
+        channel = self.channels.get(session_id)
+        if channel is None or not channel.check_token(token):
+            return None
+        return channel
+
+hub = Hub()
@@ -0,0 +1,143 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+# ---------------- CONFIG ----------------
+# AR_INFER_WORKERS=<n> runs every model call of every session on n pinned
+# model threads (0 = off: each render worker uses its own models).
+# AR_INFER_WINDOW_MS is how long the dispatcher waits for more requests
+# after the first one before handing the batch out (only while every model
+# thread is busy).
+INFER_WORKERS = int(os.environ.get("AR_INFER_WORKERS", "0"))
+INFER_WINDOW = float(os.environ.get("AR_INFER_WINDOW_MS", "2")) / 1000
+MAX_BATCH = 32
+
+# ---------------- SCHEDULER ----------------
+# MediaPipe has no batched inference API, so "batching" here means: all
+# requests that arrive within the window are grouped by model, and each
+# group is split over the model threads with the fewest queued batches.
+# A model thread then runs the same graph back to back, and the number of
+# graph instances (memory, warm-up) is set by `workers`, not by how many
+# render threads or sessions there are.
+class InferenceScheduler:
+    def __init__(self, workers=INFER_WORKERS, window=INFER_WINDOW, max_batch=MAX_BATCH):
+        self.window = window
+        self.max_batch = max_batch
+        self._inbox = queue.SimpleQueue()
+        self._queues = [queue.SimpleQueue() for _ in range(workers)]
+        self._pending = [0] * workers
+        self._lock = threading.Lock()
+
+        self.requests = 0
+        self.batches = 0
+        self.wait = 0.0      # total seconds requests spent queued
+
+        self._threads = [threading.Thread(target=self._dispatch, name="infer-dispatch", daemon=True)]
+        self._threads += [threading.Thread(target=self._work, args=(i,), name=f"infer-{i}", daemon=True)
+                          for i in range(workers)]
+        for t in self._threads:
+            t.start()
+
+    # ---------- CALLER SIDE ----------
+    def submit(self, fn, *args):
+        """Run fn(*args) on a model thread; returns a Future."""
+        fut = Future()
+        self._inbox.put((fn, args, fut, time.perf_counter()))
+        return fut
+
+    def call(self, fn, *args):
+        return self.submit(fn, *args).result()
+
+    def broadcast(self, fn, *args):
+        """Run fn(*args) once on every model thread (warm-up) and wait."""
+        futures = []
+        for i, q in enumerate(self._queues):
+            fut = Future()
+            with self._lock:
+                self._pending[i] += 1
+            q.put([(fn, args, fut, time.perf_counter())])
+            futures.append(fut)
+        return [f.result() for f in futures]
+
+    def stats(self):
+        return {
+            "workers": len(self._queues),
+            "requests": self.requests,
+            "batches": self.batches,
+            "mean_batch": round(self.requests / self.batches, 2) if self.batches else 0,
+            "mean_wait_ms": round(self.wait / self.requests * 1000, 3) if self.requests else 0,
+        }
+
+    def shutdown(self):
+        self._inbox.put(None)
+        for q in self._queues:
+            q.put(None)
+
+    # ---------- DISPATCHER ----------
+    def _collect(self, first):
+        batch = [first]
+        # waiting for more requests only pays off while every model thread
+        # is busy anyway; with one idle, hand out what is queued right away
+        with self._lock:
+            busy = all(self._pending)
+        deadline = time.perf_counter() + (self.window if busy else 0)
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            try:
+                if remaining > 0:
+                    item = self._inbox.get(timeout=remaining)
+                else:
+                    item = self._inbox.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                self._inbox.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _dispatch(self):
+        while True:
+            first = self._inbox.get()
+            if first is None:
+                return
+            batch = self._collect(first)
+            self.batches += 1
+            self.requests += len(batch)
+
+            groups = {}
+            for item in batch:
+                groups.setdefault(item[0], []).append(item)
+
+            for items in groups.values():
+                with self._lock:
+                    order = sorted(range(len(self._queues)), key=self._pending.__getitem__)
+                # deal the group out over the least busy threads
+                n = min(len(order), len(items))
+                for k in range(n):
+                    i = order[k]
+                    with self._lock:
+                        self._pending[i] += 1
+                    self._queues[i].put(items[k::n])
+
+    # ---------- MODEL THREADS ----------
+    def _work(self, i):
+        q = self._queues[i]
+        while True:
+            items = q.get()
+            if items is None:
+                return
+            wait = 0.0
+            for fn, args, fut, queued in items:
+                wait += time.perf_counter() - queued
+                if not fut.set_running_or_notify_cancel():
+                    continue
+                try:
+                    fut.set_result(fn(*args))
+                except BaseException as e:
+                    fut.set_exception(e)
+            with self._lock:
+                self._pending[i] -= 1
+                self.wait += wait
@@ -1,37 +1,257 @@
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Request, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-import cv2, base64, json, numpy as np
-from ar_engine import process_frame, handle_command
+from fastapi.responses import PlainTextResponse, StreamingResponse
+import asyncio, base64, json, sys, time, traceback
+from ar_engine import ARSession, catalog
+import batch
+from backpressure import LatestFrameSlot, PendingFrame
+from fanout import hub
+from metrics import registry
+from protocol import CODEC_JPEG, ProtocolError, pack_result, unpack_frame
+from resize_cache import resize_cache
+import workers
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app):
+    await workers.warm_up()
+    yield
+    workers.shutdown()
+
+app = FastAPI(lifespan=lifespan)
 app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"])
 
+# ---------------- METRICS ----------------
+# with AR_EXECUTOR=process the sprite cache lives in each worker, so this
+# only reports the thread-pool / main-process one
+registry.add_gauge("ar_resize_cache", resize_cache.stats)
+registry.add_gauge("ar_inference", workers.inference_stats)
+registry.add_gauge("ar_assets", catalog.stats)
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+@app.post("/metrics/{state}")
+def metrics_toggle(state: str):
+    if state not in ("on", "off"):
+        raise HTTPException(404, "expected /metrics/on or /metrics/off")
+    registry.set_enabled(state == "on")
+    return {"enabled": registry.enabled}
+
+# ---------------- BATCH API ----------------
+# POST /batch: images (multipart files and/or zips, or a raw zip body) plus
+# a filter spec; results stream back as multipart/mixed as they finish.
+# Every image gets its own session, nothing touches live connections.
+@app.post("/batch")
+async def batch_images(request: Request):
+    try:
+        spec, upload = await batch.read_upload(request)
+    except batch.BatchError as e:
+        raise HTTPException(400, str(e))
+    try:
+        state, options = batch.parse_spec(spec)
+    except batch.BatchError as e:
+        upload.close()
+        raise HTTPException(400, str(e))
+    boundary = batch.new_boundary()
+    return StreamingResponse(batch.render_stream(boundary, upload, state, options),
+                             media_type=f"multipart/mixed; boundary={boundary}")
+
+# ---------------- VIEWERS ----------------
+# Read-only copies of a live session's output for a second screen:
+# /ws/view/{id} receives the same binary result messages as the session's
+# own socket. Needs ?token=<view_token> from that session's stats / record
+# reply, so only whoever runs the session can hand out viewing access.
+@app.websocket("/ws/view/{session_id}")
+async def view(ws: WebSocket, session_id: int, token: str = ""):
+    channel = hub.get(session_id, token)
+    if channel is None:
+        await ws.close(code=4404)
+        return
+    await ws.accept()
+    slot = channel.add_viewer()
+
+    async def forward():
+        while True:
+            packed = await slot.get()
+            if packed is None:
+                # the session ended
+                await ws.close()
+                return
+            await ws.send_bytes(packed)
+
+    async def drain():
+        # anything a viewer sends is ignored
+        while (await ws.receive())["type"] != "websocket.disconnect":
+            pass
+
+    tasks = [asyncio.create_task(forward()), asyncio.create_task(drain())]
+    try:
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            task.exception()    # a viewer that vanished mid-send is not an error
+    finally:
+        for task in tasks:
+            task.cancel()
+        channel.remove_viewer(slot)
+
+def stats_message(session, **extra):
+    return json.dumps({
+        "processed": session.frames_processed,
+        "dropped": session.frames_dropped,
+        "quality": session.quality.level,
+        "session": session.id,
+        **extra,
+    })
+
+async def send_frame(ws, session, frame, send_lock, channel):
+    tm = session.timings
+    tm.observe("queue", time.perf_counter() - frame.received)
+    # legacy clients can only show base64 JPEG
+    out_codec = CODEC_JPEG if frame.legacy else session.encoder.output_codec(frame.codec)
+    buf = await workers.run_render(session, frame.payload, frame.codec, out_codec)
+    if buf is not None:     # None: camera off, nothing was processed
+        session.frames_processed += 1
+    # the process executor hands back the worker's timings in place of ours
+    tm = session.timings
+
+    packed = None
+    async with send_lock:
+        if buf is not None:
+            t = tm.start()
+            if frame.legacy:
+                await ws.send_text(base64.b64encode(buf).decode())
+                if channel.active:
+                    packed = pack_result(frame.seq, out_codec, buf)
+            else:
+                packed = pack_result(frame.seq, out_codec, buf)
+                await ws.send_bytes(packed)
+            tm.lap("send", t)
+            tm.observe("total", time.perf_counter() - frame.received)
+
+        # credit for the client: one slot is free again
+        if session.send_acks:
+            await ws.send_text(stats_message(session, type="ack", seq=frame.seq))
+
+    # the same packed bytes go to every viewer and the recorder
+    if packed is not None and channel.active:
+        channel.publish(packed)
+
+async def process_loop(ws, session, slot, send_lock, channel):
+    try:
+        while True:
+            frame = await slot.get()
+            try:
+                await send_frame(ws, session, frame, send_lock, channel)
+            except WebSocketDisconnect:
+                raise
+            except Exception as e:
+                # a frame that can't be decoded or rendered is skipped; the
+                # client still gets its credit back
+                print(f"session {session.id}: frame {frame.seq} failed: {e}", file=sys.stderr)
+                if not isinstance(e, workers.BadFrame):
+                    traceback.print_exc()
+                session.frames_dropped += 1
+                if session.send_acks:
+                    async with send_lock:
+                        await ws.send_text(stats_message(session, type="ack", seq=frame.seq, dropped_frame=True))
+    except WebSocketDisconnect:
+        pass
+    except Exception:
+        # the socket can't be served any more: don't leave the client
+        # sending into a connection nobody reads
+        print(f"session {session.id}: processing stopped", file=sys.stderr)
+        traceback.print_exc()
+        try:
+            await ws.close(code=1011)
+        except Exception:
+            pass
+
 @app.websocket("/ws")
 async def ws(ws: WebSocket):
     await ws.accept()
+    session = ARSession()
+    slot = LatestFrameSlot()
+    send_lock = asyncio.Lock()
+    channel = hub.open(session.id)
+    worker = asyncio.create_task(process_loop(ws, session, slot, send_lock, channel))
+    registry.register(session, pending=lambda: len(slot))
+
+    async def submit(frame):
+        dropped = slot.put(frame)
+        if dropped is not None:
+            session.frames_dropped += 1
+            if session.send_acks:
+                async with send_lock:
+                    await ws.send_text(stats_message(session, type="ack", seq=dropped.seq, dropped_frame=True))
+
     try:
         while True:
-            msg = await ws.receive_text()
-            if not msg.startswith("{"):
+            msg = await ws.receive()
+            if msg["type"] == "websocket.disconnect":
+                break
+
+            # ---------- BINARY FRAMES ----------
+            if msg.get("bytes") is not None:
+                try:
+                    seq, codec, payload = unpack_frame(msg["bytes"])
+                except ProtocolError:
+                    continue
+
+                await submit(PendingFrame(seq, codec, payload, False, time.perf_counter()))
                 continue
 
-            data = json.loads(msg)
+            # ---------- TEXT: COMMANDS + LEGACY JSON FRAMES ----------
+            text = msg.get("text") or ""
+            if not text.startswith("{"):
+                continue
+
+            data = json.loads(text)
 
             if data["type"] == "command":
-                handle_command(data)
+                session.handle_command(data)
 
-            elif data["type"] == "frame":
-                out = process_frame(
-                    cv2.imdecode(
-                        np.frombuffer(base64.b64decode(data["data"]), np.uint8),
-                        cv2.IMREAD_COLOR
-                    )
-                )
-                if out is None:
-                    continue
+            elif data["type"] == "config":
+                session.send_acks = bool(data.get("ack", session.send_acks))
+                # the worker picks this up (and restores full quality) on the next frame
+                session.quality.enabled = bool(data.get("adaptive", session.quality.enabled))
+                try:
+                    session.set_max_faces(data.get("max_faces", session.max_faces))
+                except (TypeError, ValueError):
+                    pass
+                if {"codec", "quality", "subsampling"} & data.keys():
+                    try:
+                        session.encoder.configure(data)
+                        reply = dict(session.encoder.describe(), type="config")
+                    except (TypeError, ValueError) as e:
+                        reply = {"type": "error", "message": str(e)}
+                    async with send_lock:
+                        await ws.send_text(json.dumps(reply))
+                if "record" in data:
+                    reply = {"type": "record"}
+                    try:
+                        if data["record"]:
+                            channel.start_recording()
+                        else:
+                            rec = channel.stop_recording()
+                            reply["saved"] = None if rec is None else rec.name
+                        reply = dict(channel.describe(), **reply)
+                    except PermissionError as e:
+                        reply = {"type": "error", "message": str(e)}
+                    async with send_lock:
+                        await ws.send_text(json.dumps(reply))
 
-                _, buf = cv2.imencode(".jpg", out)
-                await ws.send_text(base64.b64encode(buf).decode())
+            elif data["type"] == "stats":
+                async with send_lock:
+                    await ws.send_text(stats_message(session, type="stats", pending=len(slot), view_token=channel.token))
+
+            elif data["type"] == "frame":
+                await submit(PendingFrame(0, 0, base64.b64decode(data["data"]), True, time.perf_counter()))
 
     except WebSocketDisconnect:
         pass
+    finally:
+        worker.cancel()
+        registry.unregister(session)
+        hub.close(session.id)
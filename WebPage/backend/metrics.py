@@ -0,0 +1,167 @@
+import bisect
+import os
+import threading
+import time
+
+# ---------------- CONFIG ----------------
+# AR_METRICS=0 starts with timing off; it can be flipped at runtime with
+# POST /metrics/on and POST /metrics/off
+ENABLED = os.environ.get("AR_METRICS", "1") == "1"
+
+# latency buckets in seconds (Prometheus "le" bounds)
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.02, 0.033, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+# ---------------- HISTOGRAMS ----------------
+class Histogram:
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)   # last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+
+    def merge(self, other):
+        for i, c in enumerate(other.counts):
+            self.counts[i] += c
+        self.sum += other.sum
+        self.count += other.count
+
+class StageTimes:
+    """Per-session stage histograms.
+
+    Lives on the ARSession so it travels with it to process-pool workers
+    and back. Usage:  t = times.start(); ...; t = times.lap("flip", t)
+    """
+    def __init__(self, enabled=None):
+        self.enabled = ENABLED if enabled is None else enabled
+        self.stages = {}
+
+    def start(self):
+        return time.perf_counter()
+
+    def lap(self, stage, t0):
+        if not self.enabled:
+            return t0
+        now = time.perf_counter()
+        self.observe(stage, now - t0)
+        return now
+
+    def observe(self, stage, seconds):
+        if not self.enabled:
+            return
+        h = self.stages.get(stage)
+        if h is None:
+            h = self.stages[stage] = Histogram()
+        h.observe(seconds)
+
+# ---------------- REGISTRY ----------------
+# Live sessions register themselves; on disconnect their histograms and
+# counters are folded into `retired` so the aggregate never goes backwards.
+class Registry:
+    def __init__(self):
+        self.enabled = ENABLED
+        self.sessions = {}       # id -> (session, pending_frames callable)
+        self.retired = {}        # stage -> Histogram
+        self.retired_counts = {"processed": 0, "dropped": 0}
+        self.gauges = {}         # extra name -> callable returning a number/dict
+        self._lock = threading.Lock()
+
+    def set_enabled(self, enabled):
+        with self._lock:
+            self.enabled = enabled
+            for session, _ in self.sessions.values():
+                session.timings.enabled = enabled
+
+    def register(self, session, pending=lambda: 0):
+        session.timings.enabled = self.enabled
+        with self._lock:
+            self.sessions[session.id] = (session, pending)
+
+    def unregister(self, session):
+        with self._lock:
+            if self.sessions.pop(session.id, None) is None:
+                return
+            for stage, h in session.timings.stages.items():
+                self.retired.setdefault(stage, Histogram()).merge(h)
+            self.retired_counts["processed"] += session.frames_processed
+            self.retired_counts["dropped"] += session.frames_dropped
+
+    def add_gauge(self, name, fn):
+        self.gauges[name] = fn
+
+    # ---------- PROMETHEUS TEXT FORMAT ----------
+    def render(self):
+        with self._lock:
+            sessions = list(self.sessions.values())
+            total = {k: Histogram() for k in self.retired}
+            for k, h in self.retired.items():
+                total[k].merge(h)
+            processed = self.retired_counts["processed"]
+            dropped = self.retired_counts["dropped"]
+
+        lines = []
+        for session, _ in sessions:
+            for stage, h in list(session.timings.stages.items()):
+                total.setdefault(stage, Histogram()).merge(h)
+            processed += session.frames_processed
+            dropped += session.frames_dropped
+
+        lines.append("# HELP ar_metrics_enabled Whether stage timing is currently recorded.")
+        lines.append("# TYPE ar_metrics_enabled gauge")
+        lines.append(f"ar_metrics_enabled {int(self.enabled)}")
+
+        lines.append("# HELP ar_stage_seconds Time spent per pipeline stage, all sessions.")
+        lines.append("# TYPE ar_stage_seconds histogram")
+        for stage in sorted(total):
+            _histogram_lines(lines, "ar_stage_seconds", f'stage="{stage}"', total[stage])
+
+        lines.append("# HELP ar_session_stage_seconds Time spent per pipeline stage, per live session.")
+        lines.append("# TYPE ar_session_stage_seconds histogram")
+        for session, _ in sessions:
+            for stage, h in sorted(list(session.timings.stages.items())):
+                _histogram_lines(lines, "ar_session_stage_seconds",
+                                 f'session="{session.id}",stage="{stage}"', h)
+
+        lines.append("# TYPE ar_sessions gauge")
+        lines.append(f"ar_sessions {len(sessions)}")
+        lines.append("# TYPE ar_frames_processed_total counter")
+        lines.append(f"ar_frames_processed_total {processed}")
+        lines.append("# TYPE ar_frames_dropped_total counter")
+        lines.append(f"ar_frames_dropped_total {dropped}")
+
+        lines.append("# TYPE ar_session_queue_depth gauge")
+        for session, pending in sessions:
+            lines.append(f'ar_session_queue_depth{{session="{session.id}"}} {pending()}')
+        lines.append("# TYPE ar_session_frames_processed_total counter")
+        for session, _ in sessions:
+            lines.append(f'ar_session_frames_processed_total{{session="{session.id}"}} {session.frames_processed}')
+        lines.append("# TYPE ar_session_frames_dropped_total counter")
+        for session, _ in sessions:
+            lines.append(f'ar_session_frames_dropped_total{{session="{session.id}"}} {session.frames_dropped}')
+
+        for name, fn in sorted(self.gauges.items()):
+            value = fn()
+            lines.append(f"# TYPE {name} gauge")
+            if isinstance(value, dict):
+                for k, v in sorted(value.items()):
+                    lines.append(f'{name}{{key="{k}"}} {v}')
+            else:
+                lines.append(f"{name} {value}")
+
+        return "\n".join(lines) + "\n"
+
+def _histogram_lines(lines, name, labels, h):
+    cumulative = 0
+    for bound, c in zip(BUCKETS, h.counts):
+        cumulative += c
+        lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+    lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {h.count}')
+    lines.append(f"{name}_sum{{{labels}}} {h.sum:.6f}")
+    lines.append(f"{name}_count{{{labels}}} {h.count}")
+
+registry = Registry()
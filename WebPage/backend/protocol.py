@@ -0,0 +1,56 @@
+import struct
+
+# ---------------- BINARY FRAME PROTOCOL ----------------
+# Every binary websocket message is an 8 byte header followed by the raw
+# encoded image (no base64, no JSON):
+#
+#   version  u8   always PROTOCOL_VERSION
+#   kind     u8   KIND_FRAME (client -> server) / KIND_RESULT (server -> client)
+#   codec    u16  CODEC_JPEG / CODEC_WEBP
+#   seq      u32  frame number chosen by the client, echoed back in the reply
+#
+# Control commands stay on text messages as JSON. Text messages of
+# type "frame" (base64 payload) are still accepted as the legacy mode.
+
+HEADER = struct.Struct("<BBHI")
+HEADER_SIZE = HEADER.size
+
+PROTOCOL_VERSION = 1
+
+KIND_FRAME = 1
+KIND_RESULT = 2
+
+CODEC_JPEG = 0
+CODEC_WEBP = 1
+
+CODEC_EXT = {
+    CODEC_JPEG: ".jpg",
+    CODEC_WEBP: ".webp",
+}
+
+
+class ProtocolError(ValueError):
+    pass
+
+
+def unpack_frame(msg):
+    if len(msg) < HEADER_SIZE:
+        raise ProtocolError("frame shorter than header")
+
+    version, kind, codec, seq = HEADER.unpack_from(msg)
+    if version != PROTOCOL_VERSION:
+        raise ProtocolError(f"unsupported protocol version {version}")
+    if kind != KIND_FRAME:
+        raise ProtocolError(f"unexpected message kind {kind}")
+    if codec not in CODEC_EXT:
+        raise ProtocolError(f"unknown codec {codec}")
+    if len(msg) == HEADER_SIZE:
+        raise ProtocolError("frame without image data")
+
+    # memoryview so the payload is handed to imdecode without a copy
+    return seq, codec, memoryview(msg)[HEADER_SIZE:]
+
+
+def pack_result(seq, codec, payload):
+    # join() takes any buffer (e.g. the ndarray from imencode) -> single copy
+    return b"".join((HEADER.pack(PROTOCOL_VERSION, KIND_RESULT, codec, seq), payload))
@@ -0,0 +1,114 @@
+import os
+from collections import namedtuple
+
+import cv2
+
+# ---------------- CONFIG ----------------
+# AR_ADAPTIVE=0 pins every session to full quality.
+# AR_FRAME_BUDGET_MS is the processing time a frame may take (decode to
+# encode) before quality starts dropping.
+ADAPTIVE = os.environ.get("AR_ADAPTIVE", "1") == "1"
+FRAME_BUDGET = float(os.environ.get("AR_FRAME_BUDGET_MS", "40")) / 1000
+
+# jpeg_scale is a fraction of the quality the session's encoder is set to
+QualityLevel = namedtuple("QualityLevel", "seg_scale mesh_interval jpeg_scale output_scale")
+
+def default_levels(seg_scale=0.5, mesh_interval=4):
+    # level 0 is the normal configuration; each step down gives up a bit of
+    # every knob, cheapest-to-notice first (mask detail, mesh cadence),
+    # resolution last
+    s, m = seg_scale, mesh_interval
+    return [
+        QualityLevel(s,        m,     1.0,  1.0),
+        QualityLevel(s * 0.75, m + 1, 0.9,  1.0),
+        QualityLevel(s * 0.6,  m + 2, 0.8,  1.0),
+        QualityLevel(s * 0.5,  m + 4, 0.75, 0.75),
+        QualityLevel(s * 0.4,  m + 6, 0.7,  0.5),
+    ]
+
+# ---------------- CONTROLLER ----------------
+# Feed it the measured time of every frame. It keeps an EMA and steps one
+# level down after `degrade_after` frames over budget, one level up after
+# `upgrade_after` frames under `headroom` x budget. The long upgrade delay
+# keeps it from oscillating between two levels.
+class QualityController:
+    def __init__(self, levels=None, budget=FRAME_BUDGET, enabled=ADAPTIVE,
+                 degrade_after=10, upgrade_after=60, headroom=0.6, ema=0.2):
+        self.levels = levels or default_levels()
+        self.budget = budget
+        self.enabled = enabled
+        self.degrade_after = degrade_after
+        self.upgrade_after = upgrade_after
+        self.headroom = headroom
+        self.alpha = ema
+
+        self.level = 0
+        self.avg = None       # EMA of frame time, seconds
+        self.over = 0
+        self.under = 0
+        self.changes = 0
+        self._applied_scale = self.levels[0].output_scale
+
+    @property
+    def settings(self):
+        return self.levels[self.level]
+
+    def reset(self):
+        self.level = 0
+        self.avg = None
+        self.over = self.under = 0
+
+    def update(self, seconds):
+        """Record one frame time; returns True when the level changed."""
+        if not self.enabled:
+            # switched off mid-stream: go back to full quality once
+            if self.level == 0:
+                return False
+            self.reset()
+            return True
+
+        self.avg = seconds if self.avg is None else self.avg + self.alpha * (seconds - self.avg)
+
+        if self.avg > self.budget:
+            self.over += 1
+            self.under = 0
+        elif self.avg < self.budget * self.headroom:
+            self.under += 1
+            self.over = 0
+        else:
+            self.over = self.under = 0
+
+        if self.over >= self.degrade_after and self.level < len(self.levels) - 1:
+            self.level += 1
+        elif self.under >= self.upgrade_after and self.level > 0:
+            self.level -= 1
+        else:
+            return False
+
+        self.over = self.under = 0
+        self.changes += 1
+        return True
+
+    def apply(self, segmentation=None, tracker=None):
+        """Push the current settings into a SegmentationStage / LandmarkTracker."""
+        q = self.settings
+        if segmentation is not None:
+            segmentation.scale = q.seg_scale
+        if tracker is not None:
+            tracker.interval = q.mesh_interval
+
+        # a new frame size invalidates landmarks and mask history
+        if q.output_scale != self._applied_scale:
+            if segmentation is not None:
+                segmentation.reset()
+            if tracker is not None:
+                tracker.reset()
+        self._applied_scale = q.output_scale
+        return q
+
+    def scale(self, img):
+        """Downscale img to the current output_scale (no-op at 1.0)."""
+        s = self.settings.output_scale
+        if s >= 1.0:
+            return img
+        return cv2.resize(img, None, fx=s, fy=s, interpolation=cv2.INTER_AREA)
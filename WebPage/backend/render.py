@@ -0,0 +1,212 @@
+"""Offline rendering: run a video or a folder of images through the AR engine.
+
+    python render.py clip.mp4 out.mp4 --bg blur --eyes 0 --head 1
+    python render.py photos/ out/ --bg image --bg-index 2 --face
+
+Frames are read on the main process, processed in chunks by a pool of
+workers and written back in order. Video frames of a chunk share one
+ARSession, so tracking and the mask history carry over between them; every
+image of a folder gets a fresh session, since the photos are unrelated.
+"""
+import argparse
+import itertools
+import os
+import sys
+import time
+from collections import deque
+
+import cv2
+
+import ar_engine
+from workers import make_executor
+
+IMAGE_EXTS = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+VIDEO_EXTS = (".mp4", ".avi", ".mov", ".mkv", ".webm")
+
+# ---------------- READER ----------------
+def read_images(folder):
+    for f in sorted(os.listdir(folder)):
+        if f.lower().endswith(IMAGE_EXTS):
+            # workers decode: only the path crosses the process boundary
+            yield f, os.path.join(folder, f)
+
+def read_video(path):
+    cap = cv2.VideoCapture(path)
+    i = 0
+    while True:
+        ok, img = cap.read()
+        if not ok:
+            break
+        yield f"{i:06d}.png", img
+        i += 1
+    cap.release()
+
+def frame_bytes(img):
+    # size of one frame in memory; folder images are peeked at once here
+    if isinstance(img, str):
+        img = cv2.imread(img)
+    return img.nbytes if img is not None else 1920 * 1080 * 3
+
+def chunks(items, size):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+# ---------------- WORKER ----------------
+def new_session(state, start):
+    session = ar_engine.ARSession(**state)
+    session.timings.enabled = False
+    # keep the falling tears animation continuous across chunk boundaries
+    session.frame_count = start
+    session.tear_y = (start * 2) % 25
+    return session
+
+def render_chunk(state, start, items, mirror):
+    session = new_session(state, start)
+
+    out = []
+    for i, (name, img) in enumerate(items):
+        if isinstance(img, str):
+            # a photo from a folder: no mask / landmarks from the one before
+            session = new_session(state, start + i)
+            img = cv2.imread(img)
+        if img is None:
+            out.append((name, None))
+            continue
+        if not mirror:
+            # process_frame mirrors like a selfie camera; pre-flip to undo it
+            img = cv2.flip(img, 1)
+        out.append((name, ar_engine.process_frame(img, session)))
+    return out
+
+# ---------------- WRITER ----------------
+class VideoSink:
+    def __init__(self, path, fps):
+        self.path = path
+        self.fps = fps
+        self.writer = None
+
+    def write(self, name, img):
+        if self.writer is None:
+            h, w = img.shape[:2]
+            fourcc = cv2.VideoWriter_fourcc(*("VP80" if self.path.lower().endswith(".webm") else "mp4v"))
+            self.writer = cv2.VideoWriter(self.path, fourcc, self.fps, (w, h))
+            if not self.writer.isOpened():
+                sys.exit(f"cannot open {self.path} for writing")
+        self.writer.write(img)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.release()
+
+class ImageSink:
+    def __init__(self, folder, ext=None):
+        os.makedirs(folder, exist_ok=True)
+        self.folder = folder
+        self.ext = ext
+
+    def write(self, name, img):
+        if self.ext:
+            name = os.path.splitext(name)[0] + self.ext
+        cv2.imwrite(os.path.join(self.folder, name), img)
+
+    def close(self):
+        pass
+
+# ---------------- MAIN ----------------
+def build_state(args):
+    state = {"bg_mode": args.bg, "bg_i": args.bg_index}
+    for key, idx in (("eyes", "ei"), ("face", "fi"), ("head", "hi"), ("tears", "ti")):
+        value = getattr(args, key)
+        if value is not None:
+            state[key] = True
+            state[idx] = value
+    return state
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("input", help="video file or folder of images")
+    ap.add_argument("output", help="video file (.mp4/.avi/.webm) or folder")
+    ap.add_argument("--bg", choices=("original", "blur", "image"), default="original")
+    ap.add_argument("--bg-index", type=int, default=0, help="background image to use with --bg image")
+    for key in ("eyes", "face", "head", "tears"):
+        ap.add_argument(f"--{key}", type=int, nargs="?", const=0, metavar="INDEX",
+                        help=f"enable the {key} filter (optionally pick which one)")
+    ap.add_argument("--mirror", action="store_true", help="mirror the output like the live camera view")
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 2)
+    ap.add_argument("--executor", choices=("process", "thread"), default="process")
+    ap.add_argument("--chunk", type=int, default=16,
+                    help="frames per job; tracking state restarts at every chunk")
+    ap.add_argument("--memory", type=int, default=2048, metavar="MB",
+                    help="frames in flight (read, being rendered or waiting to be written) "
+                         "stay within about this much, sized from the first frame; "
+                         "at least 2 chunks are always in flight")
+    ap.add_argument("--fps", type=float, help="output frame rate (default: same as input, or 30)")
+    ap.add_argument("--ext", help="image format for folder output, e.g. .jpg (default: keep)")
+    args = ap.parse_args()
+
+    if os.path.isdir(args.input):
+        items, fps = read_images(args.input), args.fps or 30
+    elif os.path.isfile(args.input):
+        cap = cv2.VideoCapture(args.input)
+        fps = args.fps or cap.get(cv2.CAP_PROP_FPS) or 30
+        cap.release()
+        items = read_video(args.input)
+    else:
+        sys.exit(f"{args.input} not found")
+
+    if args.output.lower().endswith(VIDEO_EXTS):
+        sink = VideoSink(args.output, fps)
+    else:
+        sink = ImageSink(args.output, args.ext)
+
+    items = iter(items)
+    first = next(items, None)
+    if first is None:
+        sys.exit(f"no frames in {args.input}")
+    items = itertools.chain([first], items)
+
+    # a chunk in flight holds its input frames and then its output frames
+    # until they are written: about 2 x chunk x frame size. Up to 2 chunks
+    # per worker keeps them busy, the memory budget can lower that.
+    per_chunk = 2 * args.chunk * frame_bytes(first[1])
+    in_flight = max(2, min(args.workers * 2, args.memory * 1024 * 1024 // per_chunk))
+
+    state = build_state(args)
+    executor = make_executor(args.executor, args.workers)
+
+    pending = deque()
+    written = 0
+    t0 = time.perf_counter()
+
+    def drain(limit):
+        nonlocal written
+        while len(pending) > limit:
+            for name, img in pending.popleft().result():
+                if img is not None:
+                    sink.write(name, img)
+                written += 1
+            elapsed = time.perf_counter() - t0
+            print(f"\r{written} frames  {written / elapsed:6.1f} fps  "
+                  f"{written / elapsed / fps:5.1f}x realtime", end="", file=sys.stderr)
+
+    try:
+        start = 0
+        for chunk in chunks(items, args.chunk):
+            pending.append(executor.submit(render_chunk, state, start, chunk, args.mirror))
+            start += len(chunk)
+            drain(in_flight)
+        drain(0)
+    finally:
+        sink.close()
+        executor.shutdown(cancel_futures=True)
+    print(file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
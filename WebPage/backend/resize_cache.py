@@ -0,0 +1,81 @@
+import math
+import os
+import threading
+from collections import OrderedDict
+
+# ---------------- RESIZE CACHE ----------------
+# Face width changes by a pixel or two almost every frame, so caching the
+# exact requested size never hits. Widths are snapped to geometric buckets
+# (STEP apart, ~3%) and the caller positions the sprite using the size it
+# actually got back, so the difference is just a pixel or two of scale.
+# Entries are evicted least-recently-used once MAX_BYTES is reached.
+MAX_BYTES = int(float(os.environ.get("AR_RESIZE_CACHE_MB", "32")) * 1024 * 1024)
+STEP = 0.03
+EXACT_BELOW = 24   # tiny sprites (tears) are cheap, keep them exact
+
+class ResizeCache:
+    def __init__(self, max_bytes=MAX_BYTES, step=STEP):
+        self.max_bytes = max_bytes
+        self._log_step = math.log1p(step)
+        self._entries = OrderedDict()   # (id(src), w) -> (src, resized)
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def bucket(self, w):
+        if w < EXACT_BELOW:
+            return w
+        return int(round(math.exp(round(math.log(w) / self._log_step) * self._log_step)))
+
+    def get(self, sprite, w):
+        """Return sprite resized to ~w pixels wide, keeping its aspect ratio."""
+        w = self.bucket(max(1, int(w)))
+        key = (id(sprite), w)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        ph, pw = sprite.shape[:2]
+        resized = sprite.resized(w, max(1, int(round(w * ph / pw))))
+
+        with self._lock:
+            if key not in self._entries:
+                # the source is kept alive by the entry, so its id can't be reused
+                self._entries[key] = (sprite, resized)
+                self.bytes += resized.nbytes
+                while self.bytes > self.max_bytes and len(self._entries) > 1:
+                    _, (_, old) = self._entries.popitem(last=False)
+                    self.bytes -= old.nbytes
+                    self.evictions += 1
+        return resized
+
+    def invalidate(self, sprite):
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == id(sprite)]:
+                self.bytes -= self._entries.pop(key)[1].nbytes
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self.bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+# one cache per process, shared by every session (and the desktop app)
+resize_cache = ResizeCache()
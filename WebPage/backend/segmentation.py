@@ -0,0 +1,53 @@
+import cv2
+import numpy as np
+
+# ---------------- SEGMENTATION STAGE ----------------
+# Selfie segmentation only ever runs on a downscaled copy of the frame and
+# only every `interval` frames; in between the previous mask is reused.
+# Each new mask is blended with the last one (EMA) so edges don't flicker.
+# Callers upsample just the single-channel mask and composite at full
+# resolution, so the person keeps full detail.
+class SegmentationStage:
+    def __init__(self, scale=0.5, interval=2, ema=0.7):
+        self.scale = scale        # inference size relative to the frame
+        self.interval = interval  # run the model every N frames
+        self.ema = ema            # weight of the newest mask
+        self.mask = None          # low-res float32 person probability
+        self.frames = 0
+        self.inferences = 0
+
+    def reset(self):
+        self.mask = None
+        self.frames = 0
+
+    def update(self, img, segmentor):
+        """Return the low-res person mask (float32, 0..1) for img.
+
+        segmentor is a cvzone SelfiSegmentation, or any callable taking the
+        small RGB image and returning its float32 mask.
+        """
+        h, w = img.shape[:2]
+        sw, sh = max(1, int(w * self.scale)), max(1, int(h * self.scale))
+
+        stale = self.mask is None or self.mask.shape != (sh, sw)
+        if stale or self.frames % self.interval == 0:
+            small = cv2.resize(img, (sw, sh), interpolation=cv2.INTER_AREA)
+            rgb = cv2.cvtColor(small, cv2.COLOR_BGR2RGB)
+            mask = segmentor(rgb) if callable(segmentor) else segment(segmentor, rgb)
+            if not stale:
+                mask = cv2.addWeighted(mask, self.ema, self.mask, 1 - self.ema, 0)
+            self.mask = mask
+            self.inferences += 1
+
+        self.frames += 1
+        return self.mask
+
+def segment(segmentor, rgb):
+    # copy: MediaPipe may reuse the buffer behind this view
+    return segmentor.selfieSegmentation.process(rgb).segmentation_mask.copy()
+
+def to_alpha(mask, threshold=0.85, softness=0.1):
+    # low-res float mask -> low-res uint8 alpha: 0 below threshold - softness,
+    # 255 above threshold + softness, a linear ramp in between
+    lo = threshold - softness
+    return np.clip((mask - lo) * (255 / (2 * softness)), 0, 255).astype(np.uint8)
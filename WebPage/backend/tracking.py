@@ -0,0 +1,144 @@
+import math
+import time
+
+import cv2
+import numpy as np
+
+# ---------------- LANDMARK TRACKING ----------------
+# Full face mesh inference only runs every `interval` frames (or sooner when
+# tracking gets unreliable). In between, only the landmarks the filters
+# actually use are followed with pyramidal Lucas-Kanade optical flow and the
+# rest of the mesh is shifted along with them. A One-Euro filter smooths the
+# tracked points so overlays neither lag nor jitter.
+TRACKED = np.array([10, 33, 145, 152, 159, 234, 263, 374, 386, 454])
+
+LK_PARAMS = dict(
+    winSize=(21, 21),
+    maxLevel=3,
+    criteria=(cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 20, 0.03),
+)
+
+class OneEuroFilter:
+    # Casiez et al. One-Euro filter, vectorised over any array of points
+    def __init__(self, min_cutoff=1.0, beta=0.05, d_cutoff=1.0):
+        self.min_cutoff = min_cutoff
+        self.beta = beta
+        self.d_cutoff = d_cutoff
+        self.reset()
+
+    def reset(self):
+        self.x = None
+        self.dx = None
+        self.t = None
+
+    @staticmethod
+    def _alpha(cutoff, dt):
+        tau = 1.0 / (2 * math.pi * cutoff)
+        return 1.0 / (1.0 + tau / dt)
+
+    def __call__(self, x, t):
+        if self.x is None or self.x.shape != x.shape:
+            self.x = x.copy()
+            self.dx = np.zeros_like(x)
+            self.t = t
+            return self.x
+
+        dt = max(t - self.t, 1e-3)
+        self.dx += self._alpha(self.d_cutoff, dt) * ((x - self.x) / dt - self.dx)
+        cutoff = self.min_cutoff + self.beta * np.abs(self.dx)
+        self.x += self._alpha(cutoff, dt) * (x - self.x)
+        self.t = t
+        return self.x
+
+def match_order(old, new):
+    # order of `new` faces that best lines up with `old` (greedy on the
+    # distance between mesh centres), so each face keeps its slot and its
+    # smoothing history when the detector lists them in another order
+    d = np.linalg.norm(old.mean(axis=1)[:, None] - new.mean(axis=1)[None], axis=2)
+    order = np.empty(len(old), int)
+    for _ in range(len(old)):
+        i, j = np.unravel_index(np.argmin(d), d.shape)
+        order[i] = j
+        d[i, :] = np.inf
+        d[:, j] = np.inf
+    return order
+
+class LandmarkTracker:
+    def __init__(self, interval=4, min_confidence=0.8, smooth=True):
+        self.interval = interval              # max frames between inferences
+        self.min_confidence = min_confidence  # share of points LK must keep
+        self.smooth = OneEuroFilter() if smooth else None
+
+        self.faces = None        # (faces, 468, 2) float32, raw landmarks
+        self.prev_gray = None
+        self.since_inference = 0
+        self.inferences = 0
+        self.tracked_frames = 0
+
+    def reset(self):
+        self.faces = None
+        self.prev_gray = None
+        if self.smooth is not None:
+            self.smooth.reset()
+
+    def _track(self, gray):
+        if self.prev_gray is None or self.prev_gray.shape != gray.shape:
+            return False
+
+        pts = self.faces[:, TRACKED].reshape(-1, 1, 2)
+        new, status, _ = cv2.calcOpticalFlowPyrLK(self.prev_gray, gray, pts, None, **LK_PARAMS)
+        ok = status.ravel() == 1
+        if ok.mean() < self.min_confidence:
+            return False
+
+        new = new.reshape(self.faces.shape[0], len(TRACKED), 2)
+        ok = ok.reshape(self.faces.shape[0], len(TRACKED))
+        old = self.faces[:, TRACKED]
+        if not ok.any(axis=1).all():
+            return False
+        for i in range(self.faces.shape[0]):
+            # lost points (and the untracked part of the mesh) move with
+            # the median motion of the points LK did follow
+            shift = np.median(new[i][ok[i]] - old[i][ok[i]], axis=0)
+            self.faces[i] += shift
+            self.faces[i, TRACKED[ok[i]]] = new[i][ok[i]]
+        return True
+
+    def update(self, img, detect):
+        """Return the (faces, 468, 2) landmarks for img, or None.
+
+        detect(img) is the full inference and must return a list of faces
+        in cvzone's FaceMeshDetector format.
+        """
+        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+
+        tracked = (
+            self.faces is not None
+            and self.since_inference < self.interval - 1
+            and self._track(gray)
+        )
+        if tracked:
+            self.since_inference += 1
+            self.tracked_frames += 1
+        else:
+            faces = detect(img)
+            self.inferences += 1
+            self.since_inference = 0
+            if not faces:
+                self.reset()
+                return None
+            faces = np.asarray(faces, np.float32)
+            if self.faces is None or self.faces.shape != faces.shape:
+                if self.smooth is not None:
+                    self.smooth.reset()
+            elif len(faces) > 1:
+                faces = faces[match_order(self.faces, faces)]
+            self.faces = faces
+
+        self.prev_gray = gray
+
+        if self.smooth is None:
+            return self.faces
+        out = self.faces.copy()
+        out[:, TRACKED] = self.smooth(self.faces[:, TRACKED], time.perf_counter())
+        return out
@@ -0,0 +1,112 @@
+import asyncio
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import cv2
+
+import ar_engine
+import encoders
+from protocol import CODEC_JPEG
+
+# ---------------- CONFIG ----------------
+# AR_EXECUTOR=thread (default) or process, AR_WORKERS=<n> (default: cpu count)
+EXECUTOR_KIND = os.environ.get("AR_EXECUTOR", "thread").lower()
+WORKERS = int(os.environ.get("AR_WORKERS", "0")) or os.cpu_count() or 2
+# AR_WARMUP=1 (default) builds the models on one worker before the server
+# takes traffic, so startup doesn't grow with AR_WORKERS; the others build
+# theirs on first use. AR_WARMUP=all warms every worker, 0 none.
+WARMUP = os.environ.get("AR_WARMUP", "1").lower()
+
+def make_executor(kind=EXECUTOR_KIND, workers=WORKERS):
+    if kind == "thread":
+        return ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ar-worker")
+    if kind == "process":
+        return ProcessPoolExecutor(max_workers=workers)
+    raise ValueError(f"unknown AR_EXECUTOR {kind!r} (expected 'thread' or 'process')")
+
+executor = make_executor()
+
+# ---------------- JOB ----------------
+# decode -> process_frame -> encode, all on the worker so the event loop
+# only ever touches compressed bytes
+class BadFrame(ValueError):
+    pass
+
+def render(session, payload, codec=CODEC_JPEG, out_codec=CODEC_JPEG):
+    """Returns (encoded buffer, session); the buffer is None while the camera
+    is off. Raises BadFrame if the payload isn't an image."""
+    tm = session.timings
+    start = t = time.perf_counter()
+    img = encoders.decode(payload, codec)
+    if img is None:
+        raise BadFrame(f"could not decode {len(payload)} byte frame")
+    tm.lap("decode", t)
+    out = ar_engine.process_frame(img, session)
+    if out is None:
+        return None, session
+    t = tm.start()
+    # the quality controller scales down from what the client asked for
+    buf = session.encoder.encode(out, out_codec, session.quality.settings.jpeg_scale)
+    tm.lap("encode", t)
+
+    # adaptive quality: the next frame uses whatever level this one earned
+    quality = session.quality
+    if quality.update(time.perf_counter() - start):
+        quality.apply(session.segmentation, session.tracker)
+    return buf, session
+
+async def run_render(session, payload, codec=CODEC_JPEG, out_codec=CODEC_JPEG):
+    loop = asyncio.get_running_loop()
+    if EXECUTOR_KIND == "process":
+        # the session is pickled over and back, copy its tracking state home
+        buf, worked = await loop.run_in_executor(executor, render, session, bytes(payload), codec, out_codec)
+        session.sync_from(worked)
+        return buf
+    buf, _ = await loop.run_in_executor(executor, render, session, payload, codec, out_codec)
+    return buf
+
+# ---------------- STILL IMAGES ----------------
+# One uploaded image with its own throwaway session: nothing is shared with
+# other requests or live connections, and there's no tracking history.
+def render_image(state, options, payload):
+    """Returns (encoded buffer, codec), or (None, None) if it can't be decoded."""
+    img = encoders.decode_image(payload)
+    if img is None:
+        return None, None
+    session = ar_engine.ARSession(**state)
+    session.timings.enabled = False
+    session.quality.enabled = False
+    session.set_max_faces(options.get("max_faces", session.max_faces))
+    session.encoder.configure(options)
+    if not options.get("mirror"):
+        # process_frame mirrors like a selfie camera; pre-flip to undo it
+        img = cv2.flip(img, 1)
+    out = ar_engine.process_frame(img, session)
+    codec = session.encoder.output_codec(CODEC_JPEG)
+    return session.encoder.encode(out, codec), codec
+
+async def run_image(state, options, payload):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, render_image, state, options, bytes(payload))
+
+async def warm_up(count=None):
+    # count jobs (default: per AR_WARMUP) submitted at once so the pool
+    # spreads them; a worker that happens to take two leaves another one to
+    # warm lazily
+    if count is None:
+        count = WORKERS if WARMUP == "all" else int(WARMUP != "0")
+    loop = asyncio.get_running_loop()
+    jobs = [loop.run_in_executor(executor, ar_engine.warm_up) for _ in range(count)]
+    return set(await asyncio.gather(*jobs))
+
+def inference_stats():
+    # shared model threads of this process (thread executor only)
+    scheduler = ar_engine._scheduler
+    return scheduler.stats() if scheduler is not None else {}
+
+def shutdown():
+    executor.shutdown(wait=False, cancel_futures=True)
+    if ar_engine._scheduler is not None:
+        ar_engine._scheduler.shutdown()
+    ar_engine.catalog.stop_watching()
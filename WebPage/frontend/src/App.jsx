@@ -1,4 +1,4 @@
-import { useRef, useState } from "react";
+import { useEffect, useMemo, useRef, useState } from "react";
 import Camera from "./Camera";
 import "./ui.css";
 
@@ -7,6 +7,15 @@ export default function App() {
   const [frame, setFrame] = useState("");
   const [camOn, setCamOn] = useState(true);
 
+  // binary frames arrive as Blobs, legacy JSON frames as base64 text
+  const src = useMemo(() => {
+    if (typeof frame === "string") return frame && `data:image/jpeg;base64,${frame}`;
+    return URL.createObjectURL(frame);
+  }, [frame]);
+  useEffect(() => () => {
+    if (src.startsWith("blob:")) URL.revokeObjectURL(src);
+  }, [src]);
+
   const send = (obj) =>
     socketRef.current.send(JSON.stringify({ type: "command", ...obj }));
 
@@ -46,7 +55,7 @@ export default function App() {
 
       <div className="viewer">
         <Camera socketRef={socketRef} onFrame={setFrame} camOn={camOn} />
-        {frame && <img src={`data:image/jpeg;base64,${frame}`} />}
+        {src && <img src={src} />}
       </div>
     </div>
   );
@@ -1,5 +1,24 @@
 import { useEffect, useRef } from "react";
 
+// binary frame header: version u8, kind u8, codec u16, seq u32 (little endian)
+const HEADER_SIZE = 8;
+const KIND_FRAME = 1;
+const CODEC_JPEG = 0;
+const MIME = ["image/jpeg", "image/webp"];
+// frames allowed in flight: one being processed + one waiting on the server
+const CREDITS = 2;
+
+function packFrame(seq, jpeg) {
+  const msg = new Uint8Array(HEADER_SIZE + jpeg.byteLength);
+  const view = new DataView(msg.buffer);
+  view.setUint8(0, 1);
+  view.setUint8(1, KIND_FRAME);
+  view.setUint16(2, CODEC_JPEG, true);
+  view.setUint32(4, seq, true);
+  msg.set(new Uint8Array(jpeg), HEADER_SIZE);
+  return msg;
+}
+
 export default function Camera({ socketRef, onFrame, camOn }) {
   const video = useRef(null);
 
@@ -13,17 +32,52 @@ export default function Camera({ socketRef, onFrame, camOn }) {
   useEffect(() => {
     if (!camOn) return;
 
-    socketRef.current.onmessage = e => onFrame(e.data);
+    const sock = socketRef.current;
+    sock.binaryType = "arraybuffer";
+
+    // the server acks every frame it finished or dropped; only send when
+    // a credit is free so latency stays bounded when it falls behind
+    let inFlight = 0;
+    let lastAck = Date.now();
+    // output codec settings are negotiated in the same message
+    const enableAcks = () => sock.send(JSON.stringify({
+      type: "config", ack: true, codec: "jpeg", quality: 80, subsampling: "420",
+    }));
+    if (sock.readyState === 1) enableAcks();
+    else sock.addEventListener("open", enableAcks, { once: true });
+
+    sock.onmessage = e => {
+      if (e.data instanceof ArrayBuffer) {
+        const codec = new DataView(e.data).getUint16(2, true);
+        onFrame(new Blob([e.data.slice(HEADER_SIZE)], { type: MIME[codec] || MIME[0] }));
+      } else if (e.data.startsWith("{")) {
+        const msg = JSON.parse(e.data);
+        if (msg.type === "ack") {
+          inFlight = Math.max(0, inFlight - 1);
+          lastAck = Date.now();
+        }
+      } else {
+        // legacy JSON mode replies with base64 text
+        onFrame(e.data);
+      }
+    };
+
+    const c = document.createElement("canvas");
+    c.width = 640; c.height = 480;
+    let seq = 0;
 
     const id = setInterval(() => {
-      if (!camOn || socketRef.current.readyState !== 1) return;
-      const c = document.createElement("canvas");
-      c.width = 640; c.height = 480;
+      if (!camOn || sock.readyState !== 1) return;
+      // don't stall forever if an ack got lost
+      if (inFlight >= CREDITS && Date.now() - lastAck < 2000) return;
+      if (inFlight >= CREDITS) inFlight = 0;
+
+      inFlight++;
       c.getContext("2d").drawImage(video.current, 0, 0);
-      socketRef.current.send(JSON.stringify({
-        type:"frame",
-        data:c.toDataURL("image/jpeg").split(",")[1]
-      }));
+      c.toBlob(b => {
+        if (!b || sock.readyState !== 1) { inFlight--; return; }
+        b.arrayBuffer().then(buf => sock.send(packFrame(seq++ >>> 0, buf)));
+      }, "image/jpeg");
     }, 90);
 
     return () => clearInterval(id);
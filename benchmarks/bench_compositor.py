@@ -0,0 +1,82 @@
+"""Micro-benchmark: cvzone.overlayPNG vs the premultiplied ROI compositor.
+
+Run from the repo root:  python benchmarks/bench_compositor.py
+"""
+import argparse
+import os
+import sys
+import time
+
+import cv2
+import cvzone
+import numpy as np
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(os.path.join(ROOT, "WebPage", "backend"))
+from compositor import Sprite, overlay
+
+FILTER_DIR = os.path.join(ROOT, "WebPage", "filters")
+
+
+def old_overlay(img, png, x, y):
+    # the clipped cvzone path ar_engine.safe_overlay used before
+    h, w = img.shape[:2]
+    ph, pw = png.shape[:2]
+    x1, y1 = max(0, x), max(0, y)
+    x2, y2 = min(w, x + pw), min(h, y + ph)
+    if x1 >= x2 or y1 >= y2:
+        return img
+    px1, py1 = x1 - x, y1 - y
+    return cvzone.overlayPNG(img, png[py1:py1 + y2 - y1, px1:px1 + x2 - x1], [x1, y1])
+
+
+def bench(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t0)
+    times.sort()
+    return times[len(times) // 2] * 1000, times[int(len(times) * 0.95)] * 1000
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__)
+    ap.add_argument("--size", default="640x480", help="frame size WxH")
+    ap.add_argument("--repeat", type=int, default=300)
+    args = ap.parse_args()
+    W, H = map(int, args.size.lower().split("x"))
+
+    frame = np.random.default_rng(0).integers(0, 255, (H, W, 3), dtype=np.uint8)
+
+    # the four accessory layers at typical on-screen sizes
+    layers = []
+    for cat, width, pos in (("face", 0.45, (0.27, 0.15)), ("eyes", 0.3, (0.35, 0.35)),
+                            ("tears", 0.03, (0.4, 0.5)), ("tears", 0.03, (0.57, 0.5)),
+                            ("head", 0.55, (0.22, -0.1))):
+        folder = os.path.join(FILTER_DIR, cat)
+        name = sorted(f for f in os.listdir(folder) if f.lower().endswith(".png"))[0]
+        png = cv2.imread(os.path.join(folder, name), cv2.IMREAD_UNCHANGED)
+        tw = max(4, int(W * width))
+        th = max(4, int(tw * png.shape[0] / png.shape[1]))
+        png = cv2.resize(png, (tw, th), interpolation=cv2.INTER_AREA)
+        layers.append((png, Sprite.from_png(png), int(W * pos[0]), int(H * pos[1])))
+
+    def run_old():
+        img = frame.copy()
+        for png, _, x, y in layers:
+            img = old_overlay(img, png, x, y)
+
+    def run_new():
+        img = frame.copy()
+        for _, sprite, x, y in layers:
+            overlay(img, sprite, x, y)
+
+    run_old(), run_new()   # warm up
+    for name, fn in (("cvzone.overlayPNG", run_old), ("compositor.overlay", run_new)):
+        p50, p95 = bench(fn, args.repeat)
+        print(f"{name:20s} {W}x{H} {len(layers)} layers  p50 {p50:7.3f} ms  p95 {p95:7.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,306 @@
+"""Headless benchmark of the AR frame pipeline.
+
+Drives ar_engine.process_frame (web backend) and the desktop app's
+overlay_soft_bg / place_*_accessory functions over still frames, sweeping
+filter combinations, background modes and resolutions. Prints (or writes)
+per-stage p50/p95/p99 latency and throughput as JSON so runs can be diffed
+across commits.
+
+Run from the repo root:
+    python benchmarks/bench_pipeline.py --out bench.json
+    python benchmarks/bench_pipeline.py --quick
+"""
+import argparse
+import importlib.util
+import itertools
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from collections import defaultdict
+
+import cv2
+import numpy as np
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+BACKEND = os.path.join(ROOT, "WebPage", "backend")
+sys.path.insert(0, BACKEND)
+
+import ar_engine as engine
+import segmentation
+import tracking
+
+FRAME_DIRS = [os.path.join(ROOT, "PythonGUI", "img"), os.path.join(ROOT, "WebPage", "backgrounds")]
+FILTERS = ("face", "eyes", "tears", "head")
+BG_MODES = ("original", "blur", "image")
+RESOLUTIONS = ("640x480", "1280x720")
+
+# ---------------- TIMING ----------------
+class Timings:
+    def __init__(self):
+        self.samples = defaultdict(list)
+
+    def wrap(self, stage, fn):
+        def timed(*args, **kwargs):
+            t0 = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.samples[stage].append(time.perf_counter() - t0)
+        return timed
+
+    def add(self, stage, seconds):
+        self.samples[stage].append(seconds)
+
+    def summary(self, frames):
+        out = {}
+        for stage, xs in self.samples.items():
+            a = np.asarray(xs) * 1000
+            out[stage] = {
+                "n": len(a),
+                "per_frame": round(len(a) / frames, 3),
+                "mean_ms": round(float(a.mean()), 3),
+                "p50_ms": round(float(np.percentile(a, 50)), 3),
+                "p95_ms": round(float(np.percentile(a, 95)), 3),
+                "p99_ms": round(float(np.percentile(a, 99)), 3),
+            }
+        return out
+
+def patch(obj, name, wrapper):
+    original = getattr(obj, name)
+    setattr(obj, name, wrapper(original))
+    return lambda: setattr(obj, name, original)
+
+# ---------------- INPUTS ----------------
+def load_frames(paths):
+    frames = []
+    for d in paths:
+        if os.path.isdir(d):
+            for f in sorted(os.listdir(d)):
+                img = cv2.imread(os.path.join(d, f))
+                if img is not None:
+                    frames.append(img)
+        elif os.path.isfile(d):
+            cap = cv2.VideoCapture(d)
+            while len(frames) < 300:
+                ok, img = cap.read()
+                if not ok:
+                    break
+                frames.append(img)
+            cap.release()
+    return frames
+
+def synthetic_face(w, h):
+    # a plausible 468 point layout: the landmarks the filters read sit where
+    # they would on a frontal face, the rest fill an ellipse around it
+    cx, cy, fw = w * 0.5, h * 0.45, w * 0.22
+    t = np.linspace(0, 2 * np.pi, 468, endpoint=False)
+    face = np.stack([cx + np.cos(t) * fw * 0.5, cy + np.sin(t) * fw * 0.65], axis=1)
+    for i, (dx, dy) in {
+        10: (0, -0.55), 152: (0, 0.65), 234: (-0.5, 0), 454: (0.5, 0),
+        33: (-0.28, -0.1), 263: (0.28, -0.1), 159: (-0.2, -0.14), 386: (0.2, -0.14),
+        145: (-0.2, -0.05), 374: (0.2, -0.05),
+    }.items():
+        face[i] = (cx + dx * fw, cy + dy * fw)
+    return face.astype(np.float32)
+
+def sized(frames, res):
+    w, h = map(int, res.split("x"))
+    return [cv2.resize(f, (w, h), interpolation=cv2.INTER_AREA) for f in frames]
+
+# ---------------- ENGINE ----------------
+def bench_engine(frames, filters, bg_mode, iterations, warmup, face_mode):
+    timings = Timings()
+    session = engine.ARSession(bg_mode=bg_mode, **{k: True for k in filters})
+    h, w = frames[0].shape[:2]
+    fake = synthetic_face(w, h)
+
+    undo = [
+        patch(segmentation.SegmentationStage, "update", lambda f: timings.wrap("segmentation", f)),
+        patch(engine, "compose", lambda f: timings.wrap("overlay", f)),
+        patch(engine, "fast_blur", lambda f: timings.wrap("background", f)),
+        patch(engine.catalog.backgrounds, "get", lambda f: timings.wrap("background", f)),
+    ]
+    # sizing + sprite lookup (resize cache) of every layer
+    undo += [patch(engine, name, lambda f: timings.wrap("placement", f))
+             for name in ("place_face", "place_eyes", "place_tears", "place_head")]
+    if face_mode == "synthetic":
+        # no model call: "landmarks" then only covers optical flow tracking.
+        # Flow across the unrelated stills would move the face by hundreds
+        # of pixels, so the tracker's answer is replaced by the fixed face
+        # and every layer keeps the same size, as with a real camera.
+        def fixed(update):
+            timed = timings.wrap("landmarks", update)
+            def run(*args):
+                timed(*args)
+                return fake[None]
+            return run
+        undo.append(patch(tracking.LandmarkTracker, "update", fixed))
+        undo.append(patch(engine, "detect_faces", lambda f: lambda img, *a: [fake]))
+        undo.append(patch(engine, "detect_faces_roi", lambda f: lambda img, *a: [fake]))
+    else:
+        undo.append(patch(tracking.LandmarkTracker, "update", lambda f: timings.wrap("landmarks", f)))
+        undo.append(patch(engine, "detect_faces", lambda f: timings.wrap("mesh", f)))
+
+    try:
+        for i in range(warmup):
+            engine.process_frame(frames[i % len(frames)], session)
+        timings.samples.clear()
+
+        t_start = time.perf_counter()
+        for i in range(iterations):
+            t0 = time.perf_counter()
+            engine.process_frame(frames[i % len(frames)], session)
+            timings.add("total", time.perf_counter() - t0)
+        elapsed = time.perf_counter() - t_start
+    finally:
+        for u in reversed(undo):
+            u()
+
+    return {
+        "pipeline": "engine",
+        "filters": list(filters),
+        "bg_mode": bg_mode,
+        "resolution": f"{w}x{h}",
+        "fps": round(iterations / elapsed, 2),
+        "stages": timings.summary(iterations),
+    }
+
+# ---------------- DESKTOP APP ----------------
+def load_gui():
+    spec = importlib.util.spec_from_file_location("ar_gui", os.path.join(ROOT, "PythonGUI", "main.py"))
+    gui = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(gui)
+    return gui
+
+def bench_gui(gui, frames, bg_mode, iterations, warmup):
+    h, w = frames[0].shape[:2]
+    face = synthetic_face(w, h)
+    gui.segStage.reset()
+
+    layers = [
+        ("place_face_accessory", gui.faceAccessories),
+        ("place_eyes_accessory", gui.eyesAccessories),
+        ("place_head_accessory", gui.headAccessories),
+    ]
+
+    def run(img, timings):
+        t0 = time.perf_counter()
+        if bg_mode == "original":
+            out = img.copy()
+        else:
+            if bg_mode == "image" and gui.imgList:
+                bg = gui.bgStore.get(0, w, h)
+            else:
+                bg = gui.fast_blur(img, 51)
+            t_bg = time.perf_counter()
+            out = gui.overlay_soft_bg(img, bg, gui.segStage)
+            timings.add("background", t_bg - t0)
+            timings.add("overlay_soft_bg", time.perf_counter() - t_bg)
+
+        t1 = time.perf_counter()
+        for name, items in layers:
+            if items:
+                out = getattr(gui, name)(out, face, items[0])
+                t2 = time.perf_counter()
+                timings.add(name, t2 - t1)
+                t1 = t2
+        if gui.tearAccessories:
+            out = gui.place_tears_accessory(out, face, gui.tearAccessories[0], 6)
+            timings.add("place_tears_accessory", time.perf_counter() - t1)
+        timings.add("total", time.perf_counter() - t0)
+
+    for i in range(warmup):
+        run(frames[i % len(frames)], Timings())
+
+    timings = Timings()
+    t_start = time.perf_counter()
+    for i in range(iterations):
+        run(frames[i % len(frames)], timings)
+    elapsed = time.perf_counter() - t_start
+
+    return {
+        "pipeline": "desktop",
+        "filters": list(FILTERS),
+        "bg_mode": bg_mode,
+        "resolution": f"{w}x{h}",
+        "fps": round(iterations / elapsed, 2),
+        "stages": timings.summary(iterations),
+    }
+
+# ---------------- MAIN ----------------
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--frames", nargs="*", default=FRAME_DIRS,
+                    help="image folders and/or video files to use as input frames")
+    ap.add_argument("--resolutions", nargs="*", default=list(RESOLUTIONS))
+    ap.add_argument("--bg-modes", nargs="*", default=list(BG_MODES), choices=BG_MODES)
+    ap.add_argument("--iterations", type=int, default=60, help="measured frames per configuration")
+    ap.add_argument("--warmup", type=int, default=5)
+    ap.add_argument("--face", choices=("synthetic", "detect"), default="synthetic",
+                    help="synthetic: fixed landmarks so overlays always run; detect: real face mesh")
+    ap.add_argument("--skip-desktop", action="store_true", help="only benchmark the web backend engine")
+    ap.add_argument("--quick", action="store_true", help="one resolution, 20 frames per configuration")
+    ap.add_argument("--out", help="write JSON here instead of stdout")
+    args = ap.parse_args()
+
+    if args.quick:
+        args.resolutions = args.resolutions[:1]
+        args.iterations = 20
+
+    frames = load_frames(args.frames)
+    if not frames:
+        sys.exit("no input frames found")
+
+    # none, each filter alone, all of them
+    combos = [()] + [(f,) for f in FILTERS] + [FILTERS]
+
+    results = []
+    gui = None if args.skip_desktop else load_gui()
+    for res in args.resolutions:
+        res_frames = sized(frames, res)
+        for bg_mode, filters in itertools.product(args.bg_modes, combos):
+            results.append(bench_engine(res_frames, filters, bg_mode, args.iterations, args.warmup, args.face))
+            print(f"engine  {res:9s} {bg_mode:8s} {'+'.join(filters) or '-':22s} "
+                  f"{results[-1]['fps']:7.1f} fps", file=sys.stderr)
+        if gui is not None:
+            for bg_mode in args.bg_modes:
+                results.append(bench_gui(gui, res_frames, bg_mode, args.iterations, args.warmup))
+                print(f"desktop {res:9s} {bg_mode:8s} {'all filters':22s} "
+                      f"{results[-1]['fps']:7.1f} fps", file=sys.stderr)
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "opencv": cv2.__version__,
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+            "frames": len(frames),
+            "iterations": args.iterations,
+            "face": args.face,
+        },
+        "results": results,
+    }
+
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text)
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()